@@ -5,6 +5,7 @@ Classifies tenders by government level, size, organization type, and relevance t
 
 import re
 import logging
+from functools import lru_cache, partial
 from typing import Dict, List, Optional, Tuple, Set
 from dataclasses import dataclass
 from config import (
@@ -14,6 +15,10 @@ from config import (
 
 logger = logging.getLogger(__name__)
 
+# Keyword scan results kept per distinct text; organizations and boilerplate
+# tender titles recur across tenders, states and date chunks
+KEYWORD_HITS_CACHE_SIZE = 8192
+
 @dataclass
 class ClassificationResult:
     """Result of tender classification"""
@@ -181,6 +186,38 @@ class TenderClassifier:
             'protectfilm', 'esterilização', 'cirúrgico'
         }
 
+        # Keyword sets by category, flattened into (keyword, categories) tables so
+        # each text is scanned in a single pass instead of once per keyword set
+        self._keyword_sets = {
+            'federal': self.federal_keywords,
+            'state': self.state_keywords,
+            'municipal': self.municipal_keywords,
+            'hospital': self.hospital_keywords,
+            'health_secretariat': self.health_secretariat_keywords,
+            'university': self.university_keywords,
+            'military': self.military_keywords,
+            'medical': self.medical_keywords,
+            'high_relevance': self.high_relevance_keywords
+        }
+        self._organization_keyword_index = self._build_keyword_index(
+            'federal', 'state', 'municipal', 'hospital', 'health_secretariat', 'university', 'military')
+        # Keywords in both medical sets (e.g. 'curativo') are tested once
+        self._medical_keyword_index = self._build_keyword_index('medical', 'high_relevance')
+
+        # Memoized scans keyed by the lowercased text; callers only read the results
+        self._scan_organization_text = lru_cache(maxsize=KEYWORD_HITS_CACHE_SIZE)(
+            partial(self._find_keywords_by_category, keyword_index=self._organization_keyword_index))
+        self._scan_medical_text = lru_cache(maxsize=KEYWORD_HITS_CACHE_SIZE)(
+            partial(self._find_keywords_by_category, keyword_index=self._medical_keyword_index))
+
+    def _build_keyword_index(self, *categories: str) -> Tuple[Tuple[str, Tuple[str, ...]], ...]:
+        """Each distinct keyword of the given categories with the categories it belongs to"""
+        keyword_categories: Dict[str, List[str]] = {}
+        for category in categories:
+            for keyword in self._keyword_sets[category]:
+                keyword_categories.setdefault(keyword, []).append(category)
+        return tuple((keyword, tuple(cats)) for keyword, cats in keyword_categories.items())
+
     def _calculate_keyword_score(self, text: str, keywords: Set[str]) -> Tuple[float, List[str]]:
         """Calculate keyword matching score and return found keywords"""
         if not text:
@@ -197,10 +234,36 @@ class TenderClassifier:
         score = min(len(found_keywords) / len(keywords) * 100, 100)
         return score, found_keywords
 
+    def _find_keywords_by_category(self, text_lower: str,
+                                   keyword_index: Tuple[Tuple[str, Tuple[str, ...]], ...]) -> Dict[str, List[str]]:
+        """Keywords present in already-lowercased text, grouped by category"""
+        found: Dict[str, List[str]] = {}
+        for keyword, categories in keyword_index:
+            if keyword in text_lower:
+                for category in categories:
+                    found.setdefault(category, []).append(keyword)
+        return found
+
+    def _category_score(self, found: Dict[str, List[str]], category: str) -> Tuple[float, List[str]]:
+        """Score and found keywords for one category, as _calculate_keyword_score computes them"""
+        keywords_found = found.get(category, [])
+        score = min(len(keywords_found) / len(self._keyword_sets[category]) * 100, 100)
+        return score, keywords_found
+
+    def _organization_keyword_hits(self, org_name: str, tender_title: str,
+                                   tender_description: str) -> Dict[str, List[str]]:
+        """Government level and organization type keywords found in the organization text"""
+        combined_text = f"{org_name} {tender_title} {tender_description}".lower()
+        return self._scan_organization_text(combined_text)
+
     def classify_government_level(self, cnpj: str, org_name: str,
                                 tender_title: str = "", tender_description: str = "",
-                                structured_data: Dict = None) -> Tuple[GovernmentLevel, float, str]:
-        """Classify government level using structured data and keyword analysis"""
+                                structured_data: Dict = None,
+                                keyword_hits: Dict[str, List[str]] = None) -> Tuple[GovernmentLevel, float, str]:
+        """Classify government level using structured data and keyword analysis
+
+        keyword_hits, if given, is a precomputed _organization_keyword_hits result.
+        """
 
         # First try to use structured API data if available
         if structured_data:
@@ -215,12 +278,13 @@ class TenderClassifier:
                 return GovernmentLevel.FEDERAL, 90.0, "API data indicates district sphere (federal)"
 
         # Fall back to keyword analysis
-        combined_text = f"{org_name} {tender_title} {tender_description}".lower()
+        if keyword_hits is None:
+            keyword_hits = self._organization_keyword_hits(org_name, tender_title, tender_description)
 
         # Calculate scores for each level
-        federal_score, federal_keywords = self._calculate_keyword_score(combined_text, self.federal_keywords)
-        state_score, state_keywords = self._calculate_keyword_score(combined_text, self.state_keywords)
-        municipal_score, municipal_keywords = self._calculate_keyword_score(combined_text, self.municipal_keywords)
+        federal_score, federal_keywords = self._category_score(keyword_hits, 'federal')
+        state_score, state_keywords = self._category_score(keyword_hits, 'state')
+        municipal_score, municipal_keywords = self._category_score(keyword_hits, 'municipal')
 
         # CNPJ-based rules (simplified - would need more sophisticated logic in practice)
         cnpj_boost = 0
@@ -256,23 +320,22 @@ class TenderClassifier:
         return level, confidence, reasoning
 
     def classify_organization_type(self, org_name: str, tender_title: str = "",
-                                 tender_description: str = "", structured_data: Dict = None) -> Tuple[OrganizationType, float, str]:
-        """Classify organization type using structured data and keyword analysis"""
+                                 tender_description: str = "", structured_data: Dict = None,
+                                 keyword_hits: Dict[str, List[str]] = None) -> Tuple[OrganizationType, float, str]:
+        """Classify organization type using structured data and keyword analysis
 
-        combined_text = f"{org_name} {tender_title} {tender_description}".lower()
+        keyword_hits, if given, is a precomputed _organization_keyword_hits result.
+        """
+
+        if keyword_hits is None:
+            keyword_hits = self._organization_keyword_hits(org_name, tender_title, tender_description)
 
         # Calculate scores for each type
         scores = {}
         keywords_found = {}
 
-        scores['hospital'], keywords_found['hospital'] = self._calculate_keyword_score(
-            combined_text, self.hospital_keywords)
-        scores['health_secretariat'], keywords_found['health_secretariat'] = self._calculate_keyword_score(
-            combined_text, self.health_secretariat_keywords)
-        scores['university'], keywords_found['university'] = self._calculate_keyword_score(
-            combined_text, self.university_keywords)
-        scores['military'], keywords_found['military'] = self._calculate_keyword_score(
-            combined_text, self.military_keywords)
+        for org_category in ('hospital', 'health_secretariat', 'university', 'military'):
+            scores[org_category], keywords_found[org_category] = self._category_score(keyword_hits, org_category)
 
         # Find best match
         best_type = max(scores.keys(), key=lambda k: scores[k])
@@ -300,12 +363,13 @@ class TenderClassifier:
         """Assess if tender is relevant to medical supplies"""
 
         combined_text = f"{tender_title} {tender_description} {items_description}".lower()
+        keyword_hits = self._scan_medical_text(combined_text)
 
         # Calculate general medical relevance
-        medical_score, medical_keywords_found = self._calculate_keyword_score(combined_text, self.medical_keywords)
+        medical_score, medical_keywords_found = self._category_score(keyword_hits, 'medical')
 
         # Calculate high-relevance score (for products we specifically sell)
-        high_rel_score, high_rel_keywords = self._calculate_keyword_score(combined_text, self.high_relevance_keywords)
+        high_rel_score, high_rel_keywords = self._category_score(keyword_hits, 'high_relevance')
 
         # Combined score with weight on high-relevance keywords
         combined_score = (medical_score * 0.6) + (high_rel_score * 0.4)
@@ -414,17 +478,19 @@ class TenderClassifier:
         is_material = None
         items = tender_data.get('itens', []) or tender_data.get('itensCompra', [])
         if items:
-            # Check if any items are materials
-            material_items = [item for item in items if item.get('materialOuServico') == 'M']
-            is_material = len(material_items) > 0
+            # Check if any items are materials; stops at the first one
+            is_material = any(item.get('materialOuServico') == 'M' for item in items)
+
+        # One scan of the organization text serves both classifications below
+        keyword_hits = self._organization_keyword_hits(org_name, tender_title, tender_description)
 
         # Classify government level
         gov_level, gov_confidence, gov_reasoning = self.classify_government_level(
-            cnpj, org_name, tender_title, tender_description, tender_data)
+            cnpj, org_name, tender_title, tender_description, tender_data, keyword_hits)
 
         # Classify organization type
         org_type, org_confidence, org_reasoning = self.classify_organization_type(
-            org_name, tender_title, tender_description, tender_data)
+            org_name, tender_title, tender_description, tender_data, keyword_hits)
 
         # Classify tender size
         tender_size = classify_tender_size(total_value)
@@ -499,13 +565,34 @@ class TenderClassifier:
                               min_value: float = 1000.0) -> List[Dict]:
         """Filter tenders based on relevance criteria"""
 
+        selected = self.select_relevant_tenders(tenders_data, min_medical_score,
+                                                allowed_gov_levels, min_value)
+        return attach_classifications(tenders_data, selected)
+
+    def select_relevant_tenders(self, tenders_data: List[Dict],
+                                min_medical_score: float = 15.0,
+                                allowed_gov_levels: List[GovernmentLevel] = None,
+                                min_value: float = 1000.0) -> List[Tuple[int, ClassificationResult]]:
+        """Positions and classifications of the tenders that meet the relevance criteria
+
+        Leaves tenders_data untouched, so the work can run in another process.
+        """
+
         if allowed_gov_levels is None:
             allowed_gov_levels = [GovernmentLevel.FEDERAL, GovernmentLevel.STATE, GovernmentLevel.MUNICIPAL]
 
-        classifications = self.batch_classify(tenders_data)
-        filtered_tenders = []
+        # Check minimum value first; it is a field lookup, while classification
+        # scans every keyword set, so tenders below the minimum skip classification
+        candidates = [
+            (index, tender_data) for index, tender_data in enumerate(tenders_data)
+            if (tender_data.get('total_homologated_value', 0) or
+                tender_data.get('total_estimated_value', 0)) >= min_value
+        ]
 
-        for tender_data, classification in zip(tenders_data, classifications):
+        classifications = self.batch_classify([tender_data for _, tender_data in candidates])
+        selected = []
+
+        for (index, _), classification in zip(candidates, classifications):
             # Check medical relevance
             if classification.medical_relevance_score < min_medical_score:
                 continue
@@ -514,17 +601,41 @@ class TenderClassifier:
             if classification.government_level not in allowed_gov_levels:
                 continue
 
-            # Check minimum value
-            total_value = tender_data.get('total_homologated_value', 0) or tender_data.get('total_estimated_value', 0)
-            if total_value < min_value:
-                continue
+            selected.append((index, classification))
+
+        return selected
+
+
+def attach_classifications(tenders_data: List[Dict],
+                           selected: List[Tuple[int, ClassificationResult]]) -> List[Dict]:
+    """Add classification data to the selected tenders and return them"""
+
+    filtered_tenders = []
+    for index, classification in selected:
+        tender_data = tenders_data[index]
+        tender_data['classification'] = classification
+        filtered_tenders.append(tender_data)
+
+    logger.info(f"Filtered {len(filtered_tenders)} relevant tenders from {len(tenders_data)} total")
+    return filtered_tenders
+
+# Classifier of the current worker process, built on first use
+_worker_classifier: Optional[TenderClassifier] = None
 
-            # Add classification data to tender
-            tender_data['classification'] = classification
-            filtered_tenders.append(tender_data)
+def select_relevant_tenders_in_worker(tenders_data: List[Dict],
+                                      min_medical_score: float,
+                                      allowed_gov_levels: List[GovernmentLevel],
+                                      min_value: float) -> List[Tuple[int, ClassificationResult]]:
+    """TenderClassifier.select_relevant_tenders for process pool workers
 
-        logger.info(f"Filtered {len(filtered_tenders)} relevant tenders from {len(tenders_data)} total")
-        return filtered_tenders
+    Each worker process keeps one default classifier, so its keyword indexes and
+    scan caches are built once per process rather than once per task.
+    """
+    global _worker_classifier
+    if _worker_classifier is None:
+        _worker_classifier = TenderClassifier()
+    return _worker_classifier.select_relevant_tenders(tenders_data, min_medical_score,
+                                                      allowed_gov_levels, min_value)
 
 
 # Utility functions for analysis
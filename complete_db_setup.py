@@ -89,6 +89,29 @@ def setup_iam_auth():
         print(f"❌ Error setting up IAM auth: {e}")
         return False
 
+def configure_async_io_flags():
+    """Enable PostgreSQL 18 io_uring async I/O and parallel scans on the instance"""
+    print("⚙️ Configuring async I/O database flags (requires PostgreSQL 18)...")
+
+    # io_uring is only available from PostgreSQL 18; patching flags restarts the instance
+    database_flags = ','.join([
+        'io_method=io_uring',
+        'effective_io_concurrency=128',
+        'max_parallel_workers_per_gather=4'
+    ])
+
+    try:
+        subprocess.run([
+            'gcloud', 'sql', 'instances', 'patch', 'pncp-medical-db',
+            f'--database-flags={database_flags}',
+            '--quiet'
+        ], check=True)
+        print("✅ Async I/O flags configured")
+        return True
+    except subprocess.CalledProcessError as e:
+        print(f"❌ Error configuring database flags: {e}")
+        return False
+
 async def initialize_schema():
     """Initialize database schema"""
     print("📊 Initializing database schema...")
@@ -185,6 +208,14 @@ async def main():
         print("❌ Setup failed - could not set up IAM auth")
         return
 
+    # Optional: PostgreSQL 18 async I/O (restarts the instance)
+    if os.getenv('ENABLE_PG18_ASYNC_IO', 'false').lower() == 'true':
+        if not configure_async_io_flags():
+            print("⚠️  Could not configure async I/O flags - continuing with defaults")
+        elif not await wait_for_instance():
+            print("❌ Setup failed - instance not ready after flag update")
+            return
+
     # Step 4: Initialize schema
     print("\n⏳ Installing dependencies for schema initialization...")
     try:
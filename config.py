@@ -4,7 +4,7 @@ Contains Brazilian states, tender classifications, and system configurations
 """
 
 from enum import Enum
-from typing import Dict, List, Optional
+from typing import Dict, FrozenSet, List, Optional
 from dataclasses import dataclass
 
 # Brazilian States and Federal District
@@ -38,6 +38,9 @@ BRAZILIAN_STATES = {
     'TO': 'Tocantins'
 }
 
+# State codes as a set for O(1) validation
+STATE_CODES: FrozenSet[str] = frozenset(BRAZILIAN_STATES)
+
 # Government levels for tender classification
 class GovernmentLevel(Enum):
     FEDERAL = "federal"
@@ -125,6 +128,24 @@ class ProcessingConfig:
     max_requests_per_minute: int = 60
     max_requests_per_hour: int = 1000
 
+    # Number of tenders whose items are processed concurrently
+    max_concurrent_tenders: int = 16
+
+    # Number of states whose discovery API fetches run concurrently
+    max_concurrent_states: int = 4
+
+    # Tender batches at least this large are classified in a process pool
+    # (0 classifies every batch on the event loop)
+    min_tenders_for_process_pool: int = 500
+
+    # Drop tenders already stored by a previous run before classifying them. Saves
+    # classification and upserts on repeated runs, but stored tenders are then
+    # neither refreshed nor counted in the discovery statistics
+    skip_known_tenders: bool = False
+
+    # Exchange rate used to compare homologated BRL prices with FOB USD prices
+    usd_to_brl_rate: float = 5.0
+
     def __post_init__(self):
         """Set defaults for None values"""
         if self.enabled_states is None:
@@ -160,7 +181,9 @@ class DatabaseConfig:
     ITEM_BATCH_SIZE = 50
 
     # Cloud SQL connection settings
+    MIN_CONNECTIONS = 4
     MAX_CONNECTIONS = 20
+    STATEMENT_CACHE_SIZE = 256
     CONNECTION_TIMEOUT = 30
 
     # GCP Cloud SQL specific settings
@@ -190,10 +213,21 @@ class APIConfig:
     TENDER_ITEMS_ENDPOINT = "/v1/orgaos/{cnpj}/compras/{ano}/{sequencial}/itens"
     ITEM_RESULTS_ENDPOINT = "/v1/orgaos/{cnpj}/compras/{ano}/{sequencial}/itens/{numeroItem}/resultados"
 
+    # Connection pooling (one shared session per client)
+    CONNECTION_LIMIT = 100
+    CONNECTION_LIMIT_PER_HOST = 32
+    DNS_CACHE_TTL = 300  # seconds
+    KEEPALIVE_TIMEOUT = 60  # seconds
+
     # Request settings
     REQUEST_TIMEOUT = 30
-    MAX_RETRIES = 3
+    MAX_RETRIES = 5
     RETRY_DELAY = 1  # seconds
+    MAX_RETRY_DELAY = 30  # seconds, cap for exponential backoff
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+    # Item result requests in flight per tender (paced by the client's rate limiter)
+    MAX_CONCURRENT_ITEM_REQUESTS = 8
 
     # Response pagination
     DEFAULT_PAGE_SIZE = 100
@@ -208,9 +242,31 @@ def get_state_codes() -> List[str]:
     """Get list of all state codes"""
     return list(BRAZILIAN_STATES.keys())
 
+# Size thresholds and organization-name indicators, built once at import rather
+# than on every classified tender
+TENDER_SIZE_THRESHOLDS = TenderSizeThresholds()
+
+# Federal indicators
+FEDERAL_KEYWORDS = (
+    "ministério", "ministry", "federal", "união", "governo federal",
+    "anvisa", "sus", "fiocruz", "inca", "funasa"
+)
+
+# State indicators
+STATE_KEYWORDS = (
+    "estado", "governo do estado", "secretaria de estado",
+    "hospital do estado", "ses", "secretaria estadual"
+)
+
+# Municipal indicators
+MUNICIPAL_KEYWORDS = (
+    "município", "prefeitura", "câmara municipal", "secretaria municipal",
+    "hospital municipal", "upa", "sms", "secretaria de saúde municipal"
+)
+
 def classify_tender_size(value: float) -> TenderSize:
     """Classify tender by value"""
-    thresholds = TenderSizeThresholds()
+    thresholds = TENDER_SIZE_THRESHOLDS
 
     if value < thresholds.small_max:
         return TenderSize.SMALL
@@ -231,36 +287,15 @@ def classify_government_level(cnpj: str, org_name: str = "") -> GovernmentLevel:
 
     org_name_lower = org_name.lower()
 
-    # Federal indicators
-    federal_keywords = [
-        "ministério", "ministry", "federal", "união", "governo federal",
-        "anvisa", "sus", "fiocruz", "inca", "funasa"
-    ]
-
-    # State indicators
-    state_keywords = [
-        "estado", "governo do estado", "secretaria de estado",
-        "hospital do estado", "ses", "secretaria estadual"
-    ]
-
-    # Municipal indicators
-    municipal_keywords = [
-        "município", "prefeitura", "câmara municipal", "secretaria municipal",
-        "hospital municipal", "upa", "sms", "secretaria de saúde municipal"
-    ]
-
     # Check keywords in organization name
-    for keyword in federal_keywords:
-        if keyword in org_name_lower:
-            return GovernmentLevel.FEDERAL
+    if any(keyword in org_name_lower for keyword in FEDERAL_KEYWORDS):
+        return GovernmentLevel.FEDERAL
 
-    for keyword in state_keywords:
-        if keyword in org_name_lower:
-            return GovernmentLevel.STATE
+    if any(keyword in org_name_lower for keyword in STATE_KEYWORDS):
+        return GovernmentLevel.STATE
 
-    for keyword in municipal_keywords:
-        if keyword in org_name_lower:
-            return GovernmentLevel.MUNICIPAL
+    if any(keyword in org_name_lower for keyword in MUNICIPAL_KEYWORDS):
+        return GovernmentLevel.MUNICIPAL
 
     # Default classification based on CNPJ patterns (simplified)
     # This would need more sophisticated logic in practice
@@ -276,6 +311,7 @@ DEFAULT_CONFIG = ProcessingConfig()
 # Export key components
 __all__ = [
     'BRAZILIAN_STATES',
+    'STATE_CODES',
     'GovernmentLevel',
     'TenderSize',
     'OrganizationType',
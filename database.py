@@ -4,9 +4,12 @@ Handles database connections, schema creation, and data operations
 """
 
 import os
+import json
 import logging
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Dict, List, Optional, Any, Tuple, Set, AsyncIterator
 from datetime import datetime
+from dataclasses import dataclass, field
+from contextlib import asynccontextmanager
 import asyncio
 import asyncpg
 from google.cloud.sql.connector import Connector
@@ -18,6 +21,26 @@ from config import DatabaseConfig, GovernmentLevel, TenderSize, OrganizationType
 
 logger = logging.getLogger(__name__)
 
+# PostgreSQL binary JSONB format version byte
+JSONB_FORMAT_VERSION = b'\x01'
+
+def _encode_jsonb(value: Any) -> bytes:
+    """Encode a Python object into PostgreSQL's binary JSONB wire format"""
+    return JSONB_FORMAT_VERSION + json.dumps(value, default=str).encode('utf-8')
+
+def _decode_jsonb(data: bytes) -> Any:
+    """Decode PostgreSQL's binary JSONB wire format into a Python object"""
+    return json.loads(data[1:])
+
+@dataclass
+class ProcessingRun:
+    """In-process tally for a processing_log entry, written once on completion"""
+    log_id: int
+    process_type: str
+    records_processed: int = 0
+    records_matched: int = 0
+    started_at: datetime = field(default_factory=datetime.now)
+
 class CloudSQLManager:
     """Manages connections and operations for GCP Cloud SQL PostgreSQL"""
 
@@ -31,6 +54,8 @@ class CloudSQLManager:
         self.connector = Connector()
         self.engine = None
         self.async_engine = None
+        self.pool: Optional[asyncpg.Pool] = None
+        self._pool_lock = asyncio.Lock()
 
     def get_connection_string(self, use_async: bool = False) -> str:
         """Generate connection string for Cloud SQL"""
@@ -49,8 +74,8 @@ class CloudSQLManager:
             else:
                 return f"postgresql+pg8000://{user}:{password}@/{self.database_name}"
 
-    async def get_connection(self):
-        """Get async database connection using Cloud SQL connector"""
+    async def _connect(self, **kwargs):
+        """Open a raw asyncpg connection through the Cloud SQL connector"""
         return await self.connector.connect_async(
             instance_connection_string=self.connection_name,
             driver="asyncpg",
@@ -58,7 +83,44 @@ class CloudSQLManager:
             password=os.getenv('DB_PASSWORD', '') if not DatabaseConfig.USE_IAM_AUTH else None,
             database=self.database_name,
             enable_iam_auth=DatabaseConfig.USE_IAM_AUTH,
-            ip_type="private" if os.getenv('USE_PRIVATE_IP', 'true').lower() == 'true' else "public"
+            ip_type="private" if os.getenv('USE_PRIVATE_IP', 'true').lower() == 'true' else "public",
+            **kwargs
+        )
+
+    async def get_connection(self):
+        """Get a dedicated async database connection using Cloud SQL connector"""
+        conn = await self._connect()
+        await self._register_type_codecs(conn)
+        return conn
+
+    async def get_pool(self) -> asyncpg.Pool:
+        """Get the shared asyncpg connection pool, creating it on first use"""
+        async with self._pool_lock:
+            if self.pool is None:
+                self.pool = await asyncpg.create_pool(
+                    connect=lambda *args, **kwargs: self._connect(**kwargs),
+                    init=self._register_type_codecs,
+                    min_size=DatabaseConfig.MIN_CONNECTIONS,
+                    max_size=DatabaseConfig.MAX_CONNECTIONS,
+                    statement_cache_size=DatabaseConfig.STATEMENT_CACHE_SIZE
+                )
+        return self.pool
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Acquire a pooled connection for the duration of the block"""
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            yield conn
+
+    async def _register_type_codecs(self, conn):
+        """Send/receive JSONB in binary format so dicts skip the server-side text parse"""
+        await conn.set_type_codec(
+            'jsonb',
+            encoder=_encode_jsonb,
+            decoder=_decode_jsonb,
+            schema='pg_catalog',
+            format='binary'
         )
 
     def create_sync_engine(self):
@@ -96,7 +158,10 @@ class CloudSQLManager:
         return await self.get_connection()
 
     async def close(self):
-        """Close connector and engines"""
+        """Close pool, connector and engines"""
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
         if self.async_engine:
             await self.async_engine.dispose()
         if self.engine:
@@ -223,6 +288,17 @@ CREATE INDEX IF NOT EXISTS idx_tenders_state ON tenders(state_code);
 CREATE INDEX IF NOT EXISTS idx_tenders_gov_level ON tenders(government_level);
 CREATE INDEX IF NOT EXISTS idx_tenders_publication_date ON tenders(publication_date);
 CREATE INDEX IF NOT EXISTS idx_tenders_homologated_value ON tenders(total_homologated_value);
+CREATE INDEX IF NOT EXISTS idx_tenders_homologated_value_id ON tenders(total_homologated_value DESC, id DESC);
+
+-- Checkpoint for item extraction (added after initial release)
+ALTER TABLE tenders ADD COLUMN IF NOT EXISTS items_fetched_at TIMESTAMP;
+CREATE INDEX IF NOT EXISTS idx_tenders_items_pending ON tenders(total_homologated_value DESC, id DESC)
+    WHERE items_fetched_at IS NULL;
+-- Stamp tenders whose items were stored, or found empty, before the checkpoint
+-- existed; pending tenders are then selected by items_fetched_at alone
+UPDATE tenders t SET items_fetched_at = CURRENT_TIMESTAMP
+WHERE t.items_fetched_at IS NULL
+  AND (t.status = 'no_items' OR EXISTS (SELECT 1 FROM tender_items ti WHERE ti.tender_id = t.id));
 
 CREATE INDEX IF NOT EXISTS idx_tender_items_tender_id ON tender_items(tender_id);
 CREATE INDEX IF NOT EXISTS idx_tender_items_item_number ON tender_items(item_number);
@@ -230,6 +306,10 @@ CREATE INDEX IF NOT EXISTS idx_tender_items_item_number ON tender_items(item_num
 CREATE INDEX IF NOT EXISTS idx_matched_products_tender_item_id ON matched_products(tender_item_id);
 CREATE INDEX IF NOT EXISTS idx_matched_products_fernandes_code ON matched_products(fernandes_product_code);
 CREATE INDEX IF NOT EXISTS idx_matched_products_match_score ON matched_products(match_score);
+-- Recent competitive matches for the Notion opportunities export
+CREATE INDEX IF NOT EXISTS idx_matched_products_competitive_recent
+    ON matched_products(created_at, price_difference_percent DESC)
+    WHERE is_competitive;
 
 CREATE INDEX IF NOT EXISTS idx_processing_log_process_type ON processing_log(process_type);
 CREATE INDEX IF NOT EXISTS idx_processing_log_state ON processing_log(state_code);
@@ -239,19 +319,111 @@ CREATE INDEX IF NOT EXISTS idx_homologated_results_tender_item ON homologated_re
 CREATE INDEX IF NOT EXISTS idx_homologated_results_winner ON homologated_results(is_winner);
 """
 
+# Column order for tender item tuples loaded via COPY
+TENDER_ITEM_COLUMNS = (
+    'tender_id', 'item_number', 'description', 'unit', 'quantity',
+    'estimated_unit_value', 'estimated_total_value',
+    'homologated_unit_value', 'homologated_total_value',
+    'winner_name', 'winner_cnpj'
+)
+
+# Upsert for a single tender item tuple in TENDER_ITEM_COLUMNS order
+UPSERT_TENDER_ITEM_SQL = """
+    INSERT INTO tender_items (
+        tender_id, item_number, description, unit, quantity,
+        estimated_unit_value, estimated_total_value,
+        homologated_unit_value, homologated_total_value,
+        winner_name, winner_cnpj
+    ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
+    ON CONFLICT (tender_id, item_number) DO UPDATE SET
+        homologated_unit_value = EXCLUDED.homologated_unit_value,
+        homologated_total_value = EXCLUDED.homologated_total_value,
+        winner_name = EXCLUDED.winner_name,
+        winner_cnpj = EXCLUDED.winner_cnpj,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+# Below this many rows a prepared executemany beats staging-table COPY
+COPY_MIN_ROWS = 500
+
+# Matched product tuple order; the first two columns locate the tender item
+MATCHED_PRODUCT_COLUMNS = (
+    'tender_id', 'item_number', 'fernandes_product_code', 'fernandes_product_description',
+    'match_score', 'fob_price_usd', 'moq', 'price_comparison_brl', 'price_comparison_usd',
+    'exchange_rate', 'price_difference_percent', 'is_competitive'
+)
+
+# Upsert for a single matched product tuple in MATCHED_PRODUCT_COLUMNS order.
+# Rows whose tender item has not been stored yet select nothing and are skipped.
+UPSERT_MATCHED_PRODUCT_SQL = """
+    INSERT INTO matched_products (
+        tender_item_id, fernandes_product_code, fernandes_product_description,
+        match_score, fob_price_usd, moq, price_comparison_brl, price_comparison_usd,
+        exchange_rate, price_difference_percent, is_competitive
+    )
+    SELECT ti.id, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12
+    FROM tender_items ti
+    WHERE ti.tender_id = $1 AND ti.item_number = $2
+    ON CONFLICT (tender_item_id, fernandes_product_code) DO UPDATE SET
+        match_score = EXCLUDED.match_score,
+        fob_price_usd = EXCLUDED.fob_price_usd,
+        moq = EXCLUDED.moq,
+        price_comparison_brl = EXCLUDED.price_comparison_brl,
+        price_comparison_usd = EXCLUDED.price_comparison_usd,
+        exchange_rate = EXCLUDED.exchange_rate,
+        price_difference_percent = EXCLUDED.price_difference_percent,
+        is_competitive = EXCLUDED.is_competitive,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+# Tenders with a homologated value whose items have not been extracted yet; served
+# by the partial index idx_tenders_items_pending
+UNPROCESSED_TENDERS_SQL = """
+    SELECT t.id, t.cnpj, t.ano, t.sequencial, t.government_level,
+           t.total_homologated_value, t.state_code
+    FROM tenders t
+    WHERE t.total_homologated_value > 0
+      AND t.items_fetched_at IS NULL
+"""
+
+# Control numbers from the input array that are not yet stored in tenders
+FILTER_NEW_TENDERS_SQL = """
+    SELECT cn AS control_number
+    FROM unnest($1::text[]) AS cn
+    WHERE NOT EXISTS (SELECT 1 FROM tenders t WHERE t.control_number = cn)
+"""
+
 class DatabaseOperations:
     """Database operations for PNCP medical data"""
 
     def __init__(self, db_manager: CloudSQLManager):
         self.db_manager = db_manager
 
+        # Long-lived lookup connection and its prepared statements (per-connection)
+        self._lookup_conn = None
+        self._lookup_lock = asyncio.Lock()
+        self._ps_filter = None
+
+    async def _get_lookup_connection(self):
+        """Get the long-lived lookup connection, resetting prepared statements on reconnect"""
+        if self._lookup_conn is None or self._lookup_conn.is_closed():
+            self._lookup_conn = await self.db_manager.get_connection()
+            self._ps_filter = None
+        return self._lookup_conn
+
+    async def close(self):
+        """Close the long-lived lookup connection"""
+        if self._lookup_conn is not None and not self._lookup_conn.is_closed():
+            await self._lookup_conn.close()
+        self._lookup_conn = None
+        self._ps_filter = None
+
     async def initialize_database(self):
         """Create database schema"""
         try:
-            conn = await self.db_manager.get_connection()
-            async with conn.transaction():
-                await conn.execute(DATABASE_SCHEMA)
-            await conn.close()
+            async with self.db_manager.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute(DATABASE_SCHEMA)
             logger.info("Database schema initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize database: {e}")
@@ -259,8 +431,7 @@ class DatabaseOperations:
 
     async def insert_organization(self, org_data: Dict[str, Any]) -> int:
         """Insert or update organization and return ID"""
-        conn = await self.db_manager.get_connection()
-        try:
+        async with self.db_manager.acquire() as conn:
             # Try to get existing organization
             existing = await conn.fetchrow(
                 "SELECT id FROM organizations WHERE cnpj = $1",
@@ -288,13 +459,10 @@ class DatabaseOperations:
                     org_data.get('organization_type'), org_data.get('state_code'),
                     org_data.get('municipality_name'))
                 return org_id
-        finally:
-            await conn.close()
 
     async def insert_tender(self, tender_data: Dict[str, Any]) -> int:
         """Insert tender and return ID"""
-        conn = await self.db_manager.get_connection()
-        try:
+        async with self.db_manager.acquire() as conn:
             tender_id = await conn.fetchval("""
                 INSERT INTO tenders (
                     organization_id, cnpj, ano, sequencial, control_number, title, description,
@@ -317,30 +485,14 @@ class DatabaseOperations:
                 tender_data.get('municipality_code'), tender_data.get('status'),
                 tender_data.get('process_category'))
             return tender_id
-        finally:
-            await conn.close()
 
     async def insert_tender_items_batch(self, items_data: List[Dict[str, Any]]):
         """Insert multiple tender items efficiently"""
         if not items_data:
             return
 
-        conn = await self.db_manager.get_connection()
-        try:
-            await conn.executemany("""
-                INSERT INTO tender_items (
-                    tender_id, item_number, description, unit, quantity,
-                    estimated_unit_value, estimated_total_value,
-                    homologated_unit_value, homologated_total_value,
-                    winner_name, winner_cnpj
-                ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
-                ON CONFLICT (tender_id, item_number) DO UPDATE SET
-                    homologated_unit_value = EXCLUDED.homologated_unit_value,
-                    homologated_total_value = EXCLUDED.homologated_total_value,
-                    winner_name = EXCLUDED.winner_name,
-                    winner_cnpj = EXCLUDED.winner_cnpj,
-                    updated_at = CURRENT_TIMESTAMP
-            """, [
+        async with self.db_manager.acquire() as conn:
+            await conn.executemany(UPSERT_TENDER_ITEM_SQL, [
                 (item['tender_id'], item['item_number'], item['description'],
                  item.get('unit'), item.get('quantity'),
                  item.get('estimated_unit_value'), item.get('estimated_total_value'),
@@ -348,62 +500,151 @@ class DatabaseOperations:
                  item.get('winner_name'), item.get('winner_cnpj'))
                 for item in items_data
             ])
-        finally:
-            await conn.close()
 
-    async def get_unprocessed_tenders(self, state_code: str = None, limit: int = 100) -> List[Dict]:
-        """Get tenders that haven't been processed for item extraction"""
-        conn = await self.db_manager.get_connection()
-        try:
-            query = """
-                SELECT t.id, t.cnpj, t.ano, t.sequencial, t.government_level,
-                       t.total_homologated_value, t.state_code
-                FROM tenders t
-                LEFT JOIN tender_items ti ON t.id = ti.tender_id
-                WHERE t.total_homologated_value > 0
-                  AND ti.tender_id IS NULL
-            """
+    async def mark_items_fetched(self, tender_ids: List[int]):
+        """Checkpoint tenders whose items have been stored, or found empty, so re-runs skip them"""
+        if not tender_ids:
+            return
+
+        async with self.db_manager.acquire() as conn:
+            await conn.execute("""
+                UPDATE tenders SET items_fetched_at = CURRENT_TIMESTAMP
+                WHERE id = ANY($1::int[])
+            """, list(tender_ids))
+
+    async def copy_tender_items(self, records: List[Tuple]):
+        """Bulk-load tender item tuples (TENDER_ITEM_COLUMNS order) via COPY and upsert them"""
+        if not records:
+            return
+
+        async with self.db_manager.acquire() as conn:
+            if len(records) < COPY_MIN_ROWS:
+                # Small batches reuse the connection's cached prepared upsert
+                await conn.executemany(UPSERT_TENDER_ITEM_SQL, records)
+                return
+
+            async with conn.transaction():
+                # COPY cannot upsert, so load a staging table and merge from it
+                await conn.execute("""
+                    CREATE TEMP TABLE tender_items_staging
+                    (LIKE tender_items INCLUDING DEFAULTS) ON COMMIT DROP
+                """)
+                await conn.copy_records_to_table(
+                    'tender_items_staging', records=records, columns=TENDER_ITEM_COLUMNS
+                )
+                await conn.execute(f"""
+                    INSERT INTO tender_items ({', '.join(TENDER_ITEM_COLUMNS)})
+                    SELECT {', '.join(TENDER_ITEM_COLUMNS)} FROM tender_items_staging
+                    ON CONFLICT (tender_id, item_number) DO UPDATE SET
+                        homologated_unit_value = EXCLUDED.homologated_unit_value,
+                        homologated_total_value = EXCLUDED.homologated_total_value,
+                        winner_name = EXCLUDED.winner_name,
+                        winner_cnpj = EXCLUDED.winner_cnpj,
+                        updated_at = CURRENT_TIMESTAMP
+                """)
+
+    async def insert_matched_products_batch(self, records: List[Tuple]):
+        """Upsert matched product tuples (MATCHED_PRODUCT_COLUMNS order) in one pipelined executemany"""
+        if not records:
+            return
+
+        async with self.db_manager.acquire() as conn:
+            try:
+                await conn.executemany(UPSERT_MATCHED_PRODUCT_SQL, records)
+            except asyncpg.DataError as e:
+                # executemany is atomic, so one out-of-range value would drop the
+                # whole batch; retry row by row and skip only the offending rows
+                logger.warning("Matched products batch failed (%s); retrying %d rows individually",
+                               e, len(records))
+                for record in records:
+                    try:
+                        await conn.execute(UPSERT_MATCHED_PRODUCT_SQL, *record)
+                    except asyncpg.DataError as row_error:
+                        logger.error("Skipping matched product %s: %s", record[:3], row_error)
+
+    async def get_unprocessed_tenders(self, state_code: str = None, limit: int = 100,
+                                      after_value: float = None, after_id: int = None) -> List[Dict]:
+        """Get tenders that haven't been processed for item extraction
+
+        Results are ordered by (total_homologated_value, id) descending. Pass the
+        last row's value and id as after_value/after_id to fetch the next page
+        via an index seek instead of re-scanning from the top.
+        """
+        async with self.db_manager.acquire() as conn:
+            query = UNPROCESSED_TENDERS_SQL
             params = []
 
             if state_code:
-                query += " AND t.state_code = $1"
                 params.append(state_code)
+                query += f" AND t.state_code = ${len(params)}"
+
+            if after_value is not None and after_id is not None:
+                params.extend([after_value, after_id])
+                query += f" AND (t.total_homologated_value, t.id) < (${len(params) - 1}, ${len(params)})"
 
-            query += " ORDER BY t.total_homologated_value DESC LIMIT $" + str(len(params) + 1)
             params.append(limit)
+            query += f" ORDER BY t.total_homologated_value DESC, t.id DESC LIMIT ${len(params)}"
 
             rows = await conn.fetch(query, *params)
             return [dict(row) for row in rows]
-        finally:
-            await conn.close()
+
+    async def filter_new_tenders(self, control_numbers: List[str]) -> Set[str]:
+        """Return the subset of control numbers not yet stored in the tenders table"""
+        if not control_numbers:
+            return set()
+
+        async with self._lookup_lock:
+            conn = await self._get_lookup_connection()
+            if self._ps_filter is None:
+                self._ps_filter = await conn.prepare(FILTER_NEW_TENDERS_SQL)
+            rows = await self._ps_filter.fetch(control_numbers)
+
+        return {row['control_number'] for row in rows}
+
+    async def iter_unprocessed_tenders(self, state_code: str = None, prefetch: int = 1000,
+                                       ordered: bool = True) -> AsyncIterator[asyncpg.Record]:
+        """Stream unprocessed tenders through a server-side cursor
+
+        Rows come highest value first unless ordered is False, which lets callers
+        that drain every row skip the sort and take whatever plan is cheapest.
+        Records are yielded as-is; they support the same key and .get() access as dicts.
+        """
+        query = UNPROCESSED_TENDERS_SQL
+        params = []
+
+        if state_code:
+            params.append(state_code)
+            query += " AND t.state_code = $1"
+
+        if ordered:
+            query += " ORDER BY t.total_homologated_value DESC, t.id DESC"
+
+        async with self.db_manager.acquire() as conn:
+            async with conn.transaction():
+                async for row in conn.cursor(query, *params, prefetch=prefetch):
+                    yield row
 
     async def log_processing_start(self, process_type: str, state_code: str = None,
-                                  metadata: Dict = None) -> int:
-        """Log start of processing operation"""
-        conn = await self.db_manager.get_connection()
-        try:
+                                  metadata: Dict = None) -> ProcessingRun:
+        """Log start of processing operation and return its in-memory run tally"""
+        async with self.db_manager.acquire() as conn:
             log_id = await conn.fetchval("""
                 INSERT INTO processing_log (process_type, state_code, start_time, status, metadata)
                 VALUES ($1, $2, CURRENT_TIMESTAMP, 'running', $3)
                 RETURNING id
             """, process_type, state_code, metadata)
-            return log_id
-        finally:
-            await conn.close()
-
-    async def log_processing_end(self, log_id: int, status: str, records_processed: int = 0,
-                               records_matched: int = 0, error_message: str = None):
-        """Log end of processing operation"""
-        conn = await self.db_manager.get_connection()
-        try:
+            return ProcessingRun(log_id=log_id, process_type=process_type)
+
+    async def log_processing_end(self, run: ProcessingRun, status: str,
+                               error_message: str = None):
+        """Log end of processing operation, flushing the run's counters in a single UPDATE"""
+        async with self.db_manager.acquire() as conn:
             await conn.execute("""
                 UPDATE processing_log
                 SET end_time = CURRENT_TIMESTAMP, status = $2, records_processed = $3,
                     records_matched = $4, error_message = $5
                 WHERE id = $1
-            """, log_id, status, records_processed, records_matched, error_message)
-        finally:
-            await conn.close()
+            """, run.log_id, status, run.records_processed, run.records_matched, error_message)
 
 # Utility function to create database manager from environment variables
 def create_db_manager_from_env() -> CloudSQLManager:
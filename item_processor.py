@@ -5,22 +5,63 @@ Retrieves tender items, extracts homologated prices, and matches with Fernandes
 
 import asyncio
 import logging
-from datetime import datetime
-from typing import Dict, List, Optional, Tuple, Any
+import operator
+import time
+from typing import Dict, List, Optional, Set, Tuple, Any, AsyncIterator
 from dataclasses import dataclass
 import json
-import pandas as pd
 
 from config import ProcessingConfig
-from pncp_api import PNCPAPIClient
+from pncp_api import PNCPAPIClient, extract_data_list
 from product_matcher import ProductMatcher
-from database import DatabaseOperations
+from database import DatabaseOperations, TENDER_ITEM_COLUMNS
 
 logger = logging.getLogger(__name__)
 
+# Buffered tender item rows are flushed to the database via COPY at this size
+ITEM_COPY_BATCH_SIZE = 10_000
+
+# Builds a COPY row tuple from a processed item dict in one C-level call
+ITEM_ROW_GETTER = operator.itemgetter(*TENDER_ITEM_COLUMNS)
+
+# Builds a matched product row tuple in MATCHED_PRODUCT_COLUMNS order
+MATCH_ROW_GETTER = operator.attrgetter(
+    'tender_id', 'item_number', 'fernandes_code', 'fernandes_description',
+    'match_score', 'fob_price_usd', 'moq', 'homologated_price_brl', 'homologated_price_usd',
+    'exchange_rate', 'price_difference_percent', 'is_competitive'
+)
+
+# Idle time after which the item writer flushes a partial batch
+ITEM_FLUSH_INTERVAL_SECONDS = 0.25
+
+# Longest a buffered row waits for a flush when the queue never goes idle
+ITEM_FLUSH_MAX_WAIT_SECONDS = 2.0
+
+# Maximum per-tender row batches waiting for the item writer
+ITEM_QUEUE_SIZE = 500
+
+# How often the background reporter logs pipeline progress
+PROGRESS_REPORT_INTERVAL_SECONDS = 5
+
+# Distinct item descriptions whose best product match is memoized
+MATCH_CACHE_SIZE = 50_000
+
+# matched_products.price_difference_percent is DECIMAL(6,2); markups beyond it
+# are stored at the limit rather than failing the batch insert
+PRICE_DIFFERENCE_PERCENT_LIMIT = 9999.99
+
+# In-flight item-result requests per tender, so one large tender cannot
+# occupy the whole per-host connection pool while other workers wait
+ITEM_RESULTS_CONCURRENCY = 8
+
+# One per processed tender; every field is passed, so __slots__ can be declared
+# by hand (dataclass(slots=True) needs Python 3.10)
 @dataclass
 class ItemProcessingResult:
     """Result of processing items for a tender"""
+    __slots__ = ('tender_id', 'cnpj', 'year', 'sequential', 'total_items_found', 'items_with_results',
+                 'matched_products', 'total_homologated_value', 'processing_time_seconds', 'errors')
+
     tender_id: int
     cnpj: str
     year: int
@@ -46,6 +87,8 @@ class MatchedProduct:
     exchange_rate: float
     price_difference_percent: float
     is_competitive: bool
+    tender_id: int = 0
+    item_number: int = 0
 
 class ItemProcessor:
     """Processes tender items and matches with Fernandes products"""
@@ -59,11 +102,27 @@ class ItemProcessor:
         self.fernandes_products = fernandes_products
         self.usd_to_brl_rate = usd_to_brl_rate
 
+        # Parsed (fob_price_usd, moq) per catalog product, keyed by id() of the product dict
+        self._product_pricing: Dict[int, Tuple[float, int]] = {}
+
+        # Best catalog match per item description; identical descriptions recur across tenders
+        self._match_cache: Dict[str, Optional[Tuple[Dict, float]]] = {}
+
+        # Item rows flow from tender workers to a single COPY writer task
+        self._item_queue: Optional[asyncio.Queue] = None
+        self._item_writer: Optional[asyncio.Task] = None
+        # Tenders whose rows were in a batch the writer failed to write
+        self._unwritten_tender_ids: Set[int] = set()
+
+        # Counters updated by tender workers and logged by a single reporter task
+        self._progress = {'processed': 0, 'items': 0, 'matches': 0}
+        self._progress_reporter: Optional[asyncio.Task] = None
+
     async def process_tender_items(self, tender_id: int, cnpj: str, year: int,
                                  sequential: int) -> ItemProcessingResult:
         """Process all items for a specific tender"""
 
-        start_time = datetime.now()
+        start_time = time.perf_counter()
         result = ItemProcessingResult(
             tender_id=tender_id,
             cnpj=cnpj,
@@ -84,119 +143,264 @@ class ItemProcessor:
             if status != 200:
                 error_msg = f"Failed to get items: {status} - {items_response}"
                 result.errors.append(error_msg)
-                logger.error(f"Error getting items for {cnpj}/{year}/{sequential}: {error_msg}")
+                logger.error("Error getting items for %s/%s/%s: %s", cnpj, year, sequential, error_msg)
                 return result
 
-            items = items_response.get('data', [])
+            items = extract_data_list(items_response)
             result.total_items_found = len(items)
 
             if not items:
-                logger.info(f"No items found for tender {cnpj}/{year}/{sequential}")
+                logger.info("No items found for tender %s/%s/%s", cnpj, year, sequential)
+                # Checkpoint it like a stored tender so the unprocessed-tenders query skips it
+                await self.db_ops.mark_items_fetched([tender_id])
                 return result
 
-            # Process each item
-            processed_items = []
-            matched_products = []
+            # Pass 1: extract item records
+            extract = self._extract_item_data
+            processed_items = [
+                processed_item for processed_item in (extract(tender_id, item) for item in items)
+                if processed_item
+            ]
+
+            # Pass 2: fetch results for all items in one batch (paced by the client's rate limiter)
+            results_responses = await self.api_client.get_items_results(
+                cnpj, year, sequential,
+                [processed_item['item_number'] for processed_item in processed_items],
+                max_concurrent=ITEM_RESULTS_CONCURRENCY
+            )
 
-            for item in items:
+            # Pass 3: apply winning bids and match products
+            matched_products = []
+            for processed_item, results_response in zip(processed_items, results_responses):
                 try:
-                    processed_item, item_matches = await self._process_single_item(
-                        tender_id, item, cnpj, year, sequential
-                    )
+                    item_matches = await self._apply_item_results(processed_item, results_response)
 
-                    if processed_item:
-                        processed_items.append(processed_item)
-                        result.total_homologated_value += processed_item.get('homologated_total_value', 0) or 0
+                    result.total_homologated_value += processed_item.get('homologated_total_value', 0) or 0
 
-                        if processed_item.get('homologated_unit_value'):
-                            result.items_with_results += 1
+                    if processed_item.get('homologated_unit_value'):
+                        result.items_with_results += 1
 
                     if item_matches:
                         matched_products.extend(item_matches)
                         result.matched_products += len(item_matches)
 
-                    # Small delay between items to be respectful
-                    await asyncio.sleep(0.1)
-
                 except Exception as e:
-                    error_msg = f"Error processing item {item.get('numeroItem', 'unknown')}: {str(e)}"
+                    error_msg = f"Error processing item {processed_item.get('item_number', 'unknown')}: {str(e)}"
                     result.errors.append(error_msg)
                     logger.error(error_msg)
 
-            # Store processed items in database
+            # Hand rows to the COPY writer, or load them directly outside a pipeline.
+            # Matches are written after their items so the tender_item_id lookup finds them.
             if processed_items:
-                await self.db_ops.insert_tender_items_batch(processed_items)
-
-            # Store matched products
-            if matched_products:
-                await self._store_matched_products(matched_products)
+                rows = list(map(ITEM_ROW_GETTER, processed_items))
+                match_rows = list(map(MATCH_ROW_GETTER, matched_products))
+                if self._item_queue is not None:
+                    await self._queue_for_writer((rows, match_rows))
+                else:
+                    await self.db_ops.copy_tender_items(rows)
+                    await self._store_matched_products(match_rows)
+                    await self.db_ops.mark_items_fetched([tender_id])
 
-            result.processing_time_seconds = (datetime.now() - start_time).total_seconds()
+            result.processing_time_seconds = time.perf_counter() - start_time
 
-            logger.info(f"Processed {result.total_items_found} items for {cnpj}/{year}/{sequential}: "
-                       f"{result.matched_products} matches, R${result.total_homologated_value:,.2f} total value")
+            logger.info("Processed %d items for %s/%s/%s: %d matches, R$%.2f total value",
+                        result.total_items_found, cnpj, year, sequential,
+                        result.matched_products, result.total_homologated_value)
 
         except Exception as e:
             error_msg = f"Error processing tender {cnpj}/{year}/{sequential}: {str(e)}"
             result.errors.append(error_msg)
             logger.error(error_msg)
 
+        progress = self._progress
+        progress['processed'] += 1
+        progress['items'] += result.total_items_found
+        progress['matches'] += result.matched_products
+
         return result
 
-    async def _process_single_item(self, tender_id: int, item: Dict, cnpj: str,
-                                 year: int, sequential: int) -> Tuple[Optional[Dict], List[MatchedProduct]]:
-        """Process a single tender item"""
+    async def start_progress_reporter(self, total: Optional[int] = None):
+        """Start the background task that periodically logs pipeline progress"""
+        if self._progress_reporter is None:
+            self._progress = {'processed': 0, 'items': 0, 'matches': 0}
+            self._progress_reporter = asyncio.create_task(self._report_progress(total))
+
+    async def stop_progress_reporter(self):
+        """Stop the progress reporter task"""
+        if self._progress_reporter is not None:
+            self._progress_reporter.cancel()
+            try:
+                await self._progress_reporter
+            except asyncio.CancelledError:
+                pass
+            self._progress_reporter = None
+
+    async def _report_progress(self, total: Optional[int]):
+        """Log progress counters on a fixed interval, independent of tender completion rate"""
+        progress = self._progress
+        while True:
+            await asyncio.sleep(PROGRESS_REPORT_INTERVAL_SECONDS)
+            logger.info("Progress: %d/%s tenders, %d items, %d matches",
+                        progress['processed'], total if total is not None else '?',
+                        progress['items'], progress['matches'])
+
+    async def start_item_writer(self):
+        """Start the background task that bulk-loads item rows via COPY"""
+        if self._item_writer is None:
+            self._item_queue = asyncio.Queue(maxsize=ITEM_QUEUE_SIZE)
+            self._unwritten_tender_ids = set()
+            self._item_writer = asyncio.create_task(self._write_items())
+
+    async def stop_item_writer(self) -> Set[int]:
+        """Flush any remaining item rows and stop the writer task
+
+        Returns the IDs of tenders whose rows the writer failed to write; their
+        process_tender_items results had already been returned without an error.
+        """
+        if self._item_writer is None:
+            return set()
+
+        try:
+            await self._queue_for_writer(None)
+            await self._item_writer
+        finally:
+            self._item_writer = None
+            self._item_queue = None
+
+        unwritten, self._unwritten_tender_ids = self._unwritten_tender_ids, set()
+        if unwritten:
+            logger.error("Item rows of %d tenders were not written to the database", len(unwritten))
+        return unwritten
+
+    @staticmethod
+    def record_unwritten_tenders(results: List, unwritten_tender_ids: Set[int]):
+        """Add an error to each result whose item rows the writer failed to write"""
+        if not unwritten_tender_ids:
+            return
+        for result in results:
+            if isinstance(result, ItemProcessingResult) and result.tender_id in unwritten_tender_ids:
+                result.errors.append("Failed to write tender items to database")
+
+    async def _queue_for_writer(self, entry):
+        """Queue an entry for the writer task, raising its error if it has died
+
+        A plain put on the bounded queue would block forever once the writer stops
+        draining it, so a full queue is waited on together with the writer task.
+        """
+        queue, writer = self._item_queue, self._item_writer
+        if writer.done():
+            writer.result()
+            raise RuntimeError("Item writer stopped before the pipeline finished")
+
+        if not queue.full():
+            queue.put_nowait(entry)
+            return
+
+        put = asyncio.ensure_future(queue.put(entry))
+        await asyncio.wait((put, writer), return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+            writer.result()
+            raise RuntimeError("Item writer stopped before the pipeline finished")
+
+    async def _write_items(self):
+        """Accumulate queued item and match rows and write them at batch size or when idle"""
+        loop = asyncio.get_running_loop()
+        batch: List[Tuple] = []
+        match_batch: List[Tuple] = []
+        batch_started = 0.0
+        done = False
+
+        while not done:
+            try:
+                entry = await asyncio.wait_for(self._item_queue.get(), ITEM_FLUSH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                entry = ()
+
+            if entry is None:
+                done = True
+            elif entry:
+                rows, match_rows = entry
+                if not batch:
+                    batch_started = loop.time()
+                batch.extend(rows)
+                match_batch.extend(match_rows)
+
+            if batch and (done or not entry or len(batch) >= ITEM_COPY_BATCH_SIZE
+                          or loop.time() - batch_started >= ITEM_FLUSH_MAX_WAIT_SECONDS):
+                await self._copy_items(batch, match_batch)
+                batch = []
+                match_batch = []
+
+    async def _copy_items(self, records: List[Tuple], match_records: List[Tuple]):
+        """COPY a batch of item rows and their matches
+
+        Failures are logged and the batch's tenders recorded for stop_item_writer,
+        so the pipeline keeps running for the other batches.
+        """
+        tender_ids = {record[0] for record in records}
+        try:
+            await self.db_ops.copy_tender_items(records)
+            await self._store_matched_products(match_records)
+            await self.db_ops.mark_items_fetched(tender_ids)
+            logger.info(f"Flushed {len(records)} tender items and {len(match_records)} matches to database")
+        except Exception as e:
+            logger.error(f"Error writing {len(records)} tender items: {e}")
+            self._unwritten_tender_ids.update(tender_ids)
 
-        item_number = item.get('numeroItem')
+    def _extract_item_data(self, tender_id: int, item: Dict) -> Optional[Dict]:
+        """Extract item record from API item data"""
+
+        # Bind hot lookups to locals once per item
+        get = item.get
+        safe_float = self._safe_float
+
+        item_number = get('numeroItem')
         if not item_number:
-            return None, []
+            return None
 
-        # Extract item data
-        processed_item = {
+        return {
             'tender_id': tender_id,
             'item_number': item_number,
-            'description': item.get('descricao', ''),
-            'unit': item.get('unidadeMedida'),
-            'quantity': self._safe_float(item.get('quantidade')),
-            'estimated_unit_value': self._safe_float(item.get('valorUnitarioEstimado')),
-            'estimated_total_value': self._safe_float(item.get('valorTotalEstimado')),
+            'description': get('descricao', ''),
+            'unit': get('unidadeMedida'),
+            'quantity': safe_float(get('quantidade')),
+            'estimated_unit_value': safe_float(get('valorUnitarioEstimado')),
+            'estimated_total_value': safe_float(get('valorTotalEstimado')),
             'homologated_unit_value': None,
             'homologated_total_value': None,
             'winner_name': None,
             'winner_cnpj': None
         }
 
-        matched_products = []
+    async def _apply_item_results(self, processed_item: Dict, results_response) -> List[MatchedProduct]:
+        """Apply the winning bid from an item-results response and match products"""
 
-        try:
-            # Get item results (winning bids)
-            results_status, results_response = await self.api_client.get_item_results(
-                cnpj, year, sequential, item_number
-            )
-
-            if results_status == 200:
-                results = results_response.get('data', [])
+        if isinstance(results_response, Exception):
+            logger.warning("Error getting results for item %s: %s", processed_item['item_number'], results_response)
+            return []
 
-                # Find winning result (highest ranking or marked as winner)
-                winning_result = self._find_winning_result(results)
+        results_status, results_data = results_response
+        if results_status != 200:
+            return []
 
-                if winning_result:
-                    processed_item.update({
-                        'homologated_unit_value': self._safe_float(winning_result.get('valorUnitario')),
-                        'homologated_total_value': self._safe_float(winning_result.get('valorTotal')),
-                        'winner_name': winning_result.get('nomeProponente'),
-                        'winner_cnpj': winning_result.get('cnpjProponente')
-                    })
+        # Find winning result (highest ranking or marked as winner)
+        winning_result = self._find_winning_result(extract_data_list(results_data))
+        if not winning_result:
+            return []
 
-                    # Try to match with Fernandes products
-                    if processed_item['description']:
-                        matches = await self._match_item_with_products(processed_item)
-                        matched_products.extend(matches)
+        processed_item.update({
+            'homologated_unit_value': self._safe_float(winning_result.get('valorUnitario')),
+            'homologated_total_value': self._safe_float(winning_result.get('valorTotal')),
+            'winner_name': winning_result.get('nomeProponente'),
+            'winner_cnpj': winning_result.get('cnpjProponente')
+        })
 
-        except Exception as e:
-            logger.warning(f"Error getting results for item {item_number}: {e}")
+        # Try to match with Fernandes products
+        if processed_item['description']:
+            return await self._match_item_with_products(processed_item)
 
-        return processed_item, matched_products
+        return []
 
     def _find_winning_result(self, results: List[Dict]) -> Optional[Dict]:
         """Find the winning result from a list of bid results"""
@@ -222,51 +426,65 @@ class ItemProcessor:
         if not item['description'] or not item.get('homologated_unit_value'):
             return []
 
-        # Use product matcher to find matches
-        match_result = self.product_matcher.find_best_match(
-            item['description'], self.fernandes_products
-        )
+        # Use product matcher to find matches, reusing the result for repeated descriptions
+        description = item['description']
+        try:
+            match_result = self._match_cache[description]
+        except KeyError:
+            match_result = self.product_matcher.find_best_match(description, self.fernandes_products)
+            if len(self._match_cache) >= MATCH_CACHE_SIZE:
+                self._match_cache.clear()
+            self._match_cache[description] = match_result
 
         if not match_result:
             return []
 
         product, match_score = match_result
 
-        # Calculate pricing comparison
-        homologated_price_brl = item['homologated_unit_value']
-        homologated_price_usd = homologated_price_brl / self.usd_to_brl_rate
-        fob_price_usd = float(product.get('FOB NINGBO USD/unit', 0))
-
+        fob_price_usd, moq = self._get_product_pricing(product)
         if fob_price_usd <= 0:
             return []  # Can't compare without FOB price
 
+        # Calculate pricing comparison
+        usd_to_brl_rate = self.usd_to_brl_rate
+        homologated_price_brl = item['homologated_unit_value']
+        homologated_price_usd = homologated_price_brl / usd_to_brl_rate
+
         price_difference_percent = ((homologated_price_usd - fob_price_usd) / fob_price_usd) * 100
         is_competitive = price_difference_percent <= 200  # Less than 200% markup is competitive
+        price_difference_percent = max(-PRICE_DIFFERENCE_PERCENT_LIMIT,
+                                       min(price_difference_percent, PRICE_DIFFERENCE_PERCENT_LIMIT))
 
         matched_product = MatchedProduct(
-            tender_item_id=0,  # Will be set when storing
+            tender_item_id=0,  # Resolved from (tender_id, item_number) when storing
             fernandes_code=product.get('CÓDIGO', ''),
             fernandes_description=product.get('DESCRIÇÃO', ''),
             match_score=match_score,
             fob_price_usd=fob_price_usd,
-            moq=int(product.get('MOQ/unit', 0)),
+            moq=moq,
             homologated_price_brl=homologated_price_brl,
             homologated_price_usd=homologated_price_usd,
-            exchange_rate=self.usd_to_brl_rate,
+            exchange_rate=usd_to_brl_rate,
             price_difference_percent=price_difference_percent,
-            is_competitive=is_competitive
+            is_competitive=is_competitive,
+            tender_id=item['tender_id'],
+            item_number=item['item_number']
         )
 
         return [matched_product]
 
-    async def _store_matched_products(self, matched_products: List[MatchedProduct]):
-        """Store matched products in database"""
+    def _get_product_pricing(self, product: Dict) -> Tuple[float, int]:
+        """FOB price and MOQ for a catalog product, parsed once per product"""
+        pricing = self._product_pricing.get(id(product))
+        if pricing is None:
+            pricing = (float(product.get('FOB NINGBO USD/unit', 0)), int(product.get('MOQ/unit', 0)))
+            self._product_pricing[id(product)] = pricing
+        return pricing
 
-        # This would need to be implemented in DatabaseOperations
-        # For now, log the matches
-        for match in matched_products:
-            logger.info(f"Matched product: {match.fernandes_code} with score {match.match_score:.1f}%, "
-                       f"price difference: {match.price_difference_percent:+.1f}%")
+    async def _store_matched_products(self, match_rows: List[Tuple]):
+        """Store matched product rows (MATCH_ROW_GETTER order) in one batch"""
+        if match_rows:
+            await self.db_ops.insert_matched_products_batch(match_rows)
 
     def _safe_float(self, value) -> Optional[float]:
         """Safely convert value to float"""
@@ -277,11 +495,16 @@ class ItemProcessor:
         except (ValueError, TypeError):
             return None
 
-    async def process_multiple_tenders(self, tender_list: List[Dict],
-                                     max_concurrent: int = 5) -> List[ItemProcessingResult]:
-        """Process multiple tenders concurrently with rate limiting"""
+    async def process_multiple_tenders(self, tender_list: List[Dict], max_concurrent: int = 5,
+                                     semaphore: Optional[asyncio.Semaphore] = None) -> List[ItemProcessingResult]:
+        """Process multiple tenders concurrently with rate limiting
+
+        Pass a semaphore to share one concurrency budget across several concurrent
+        calls; tenders then start in list order as slots free up in any call.
+        """
 
-        semaphore = asyncio.Semaphore(max_concurrent)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(max_concurrent)
         results = []
 
         async def process_with_semaphore(tender):
@@ -290,19 +513,77 @@ class ItemProcessor:
                     tender['id'], tender['cnpj'], tender['ano'], tender['sequencial']
                 )
 
-        tasks = [process_with_semaphore(tender) for tender in tender_list]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        # Open the shared session up front so every request reuses its connection pool
+        await self.api_client.start_session()
+
+        # A caller running several batches at once may already own the writer and
+        # reporter; it then gets the unwritten tenders from its own stop_item_writer
+        owns_pipeline = self._item_writer is None
+        unwritten_tender_ids: Set[int] = set()
+        await self.start_item_writer()
+        await self.start_progress_reporter(len(tender_list))
+        try:
+            tasks = [process_with_semaphore(tender) for tender in tender_list]
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            if owns_pipeline:
+                await self.stop_progress_reporter()
+                unwritten_tender_ids = await self.stop_item_writer()
+
+        self.record_unwritten_tenders(results, unwritten_tender_ids)
 
         # Handle exceptions
         processed_results = []
         for i, result in enumerate(results):
             if isinstance(result, Exception):
-                logger.error(f"Error processing tender {tender_list[i].get('cnpj', 'unknown')}: {result}")
+                logger.error("Error processing tender %s: %s", tender_list[i].get('cnpj', 'unknown'), result)
             else:
                 processed_results.append(result)
 
         return processed_results
 
+    async def process_tender_stream(self, tenders: AsyncIterator[Dict], max_concurrent: int = 5,
+                                    queue_size: int = 2000) -> List[ItemProcessingResult]:
+        """Process a stream of tenders: cursor producer -> API workers -> single COPY writer"""
+
+        tender_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        results = []
+
+        async def produce():
+            try:
+                async for tender in tenders:
+                    await tender_queue.put(tender)
+            finally:
+                # One sentinel per worker signals shutdown
+                for _ in range(max_concurrent):
+                    await tender_queue.put(None)
+
+        async def work():
+            while (tender := await tender_queue.get()) is not None:
+                try:
+                    results.append(await self.process_tender_items(
+                        tender['id'], tender['cnpj'], tender['ano'], tender['sequencial']
+                    ))
+                except Exception as e:
+                    logger.error("Error processing tender %s: %s", tender.get('cnpj', 'unknown'), e)
+
+        # Open the shared session up front so every request reuses its connection pool
+        await self.api_client.start_session()
+
+        owns_pipeline = self._item_writer is None
+        unwritten_tender_ids: Set[int] = set()
+        await self.start_item_writer()
+        await self.start_progress_reporter()
+        try:
+            await asyncio.gather(produce(), *(work() for _ in range(max_concurrent)))
+        finally:
+            if owns_pipeline:
+                await self.stop_progress_reporter()
+                unwritten_tender_ids = await self.stop_item_writer()
+
+        self.record_unwritten_tenders(results, unwritten_tender_ids)
+        return results
+
     async def get_processing_statistics(self) -> Dict[str, Any]:
         """Get statistics about processed items and matches"""
 
@@ -332,6 +613,7 @@ class ProductCatalogManager:
     def load_catalog_from_csv(self, csv_path: str):
         """Load catalog from CSV file"""
         try:
+            import pandas as pd  # only the CSV helpers need it; keeps imports of this module light
             df = pd.read_csv(csv_path)
             self.products = df.to_dict('records')
             logger.info(f"Loaded {len(self.products)} products from {csv_path}")
@@ -350,6 +632,7 @@ class ProductCatalogManager:
     def export_to_csv(self, output_path: str):
         """Export catalog to CSV"""
         if self.products:
+            import pandas as pd
             df = pd.DataFrame(self.products)
             df.to_csv(output_path, index=False)
             logger.info(f"Exported {len(self.products)} products to {output_path}")
@@ -389,22 +672,29 @@ async def process_unprocessed_tenders(db_operations: DatabaseOperations,
                                     api_client: PNCPAPIClient,
                                     fernandes_products: List[Dict],
                                     state_code: str = None,
-                                    limit: int = 50) -> List[ItemProcessingResult]:
-    """Process tenders that haven't had their items extracted yet"""
-
-    # Get unprocessed tenders
-    unprocessed = await db_operations.get_unprocessed_tenders(state_code, limit)
-
-    if not unprocessed:
-        logger.info("No unprocessed tenders found")
-        return []
+                                    limit: Optional[int] = 50) -> List[ItemProcessingResult]:
+    """Process tenders that haven't had their items extracted yet (all of them if limit is None)"""
 
     # Create processor
     product_matcher = ProductMatcher()
     processor = ItemProcessor(api_client, product_matcher, db_operations, fernandes_products)
 
-    # Process tenders
-    results = await processor.process_multiple_tenders(unprocessed)
+    if limit is None:
+        # Stream every unprocessed tender instead of materializing them all. Every
+        # row is processed and items_fetched_at checkpoints progress, so order is moot.
+        results = await processor.process_tender_stream(
+            db_operations.iter_unprocessed_tenders(state_code, ordered=False)
+        )
+    else:
+        # Get unprocessed tenders
+        unprocessed = await db_operations.get_unprocessed_tenders(state_code, limit)
+
+        if not unprocessed:
+            logger.info("No unprocessed tenders found")
+            return []
+
+        # Process tenders
+        results = await processor.process_multiple_tenders(unprocessed)
 
     logger.info(f"Processed {len(results)} tenders")
     return results
@@ -416,12 +706,20 @@ def summarize_processing_results(results: List[ItemProcessingResult]) -> Dict[st
         return {}
 
     total_tenders = len(results)
-    total_items = sum(r.total_items_found for r in results)
-    total_items_with_results = sum(r.items_with_results for r in results)
-    total_matches = sum(r.matched_products for r in results)
-    total_value = sum(r.total_homologated_value for r in results)
-    total_time = sum(r.processing_time_seconds for r in results)
-    total_errors = sum(len(r.errors) for r in results)
+    total_items = total_items_with_results = total_matches = 0
+    total_value = total_time = 0.0
+    total_errors = failed_tenders = 0
+
+    # Single pass over the results instead of one sum() per metric
+    for r in results:
+        total_items += r.total_items_found
+        total_items_with_results += r.items_with_results
+        total_matches += r.matched_products
+        total_value += r.total_homologated_value
+        total_time += r.processing_time_seconds
+        if r.errors:
+            total_errors += len(r.errors)
+            failed_tenders += 1
 
     return {
         'total_tenders_processed': total_tenders,
@@ -433,7 +731,7 @@ def summarize_processing_results(results: List[ItemProcessingResult]) -> Dict[st
         'average_items_per_tender': total_items / total_tenders if total_tenders > 0 else 0,
         'match_rate_percent': (total_matches / total_items * 100) if total_items > 0 else 0,
         'total_errors': total_errors,
-        'success_rate_percent': ((total_tenders - len([r for r in results if r.errors])) / total_tenders * 100) if total_tenders > 0 else 0
+        'success_rate_percent': ((total_tenders - failed_tenders) / total_tenders * 100) if total_tenders > 0 else 0
     }
 
 # Testing function
@@ -4,16 +4,22 @@ Coordinates the complete workflow from tender discovery to price analysis
 """
 
 import asyncio
+import atexit
 import logging
 import json
 import os
 import argparse
+import queue
+import re
+import time
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
-import pandas as pd
+from typing import Dict, List, Optional, Set, Any
+import asyncpg
+import orjson
 
 from config import (
-    ProcessingConfig, DatabaseConfig, get_state_codes,
+    ProcessingConfig, DatabaseConfig, STATE_CODES,
     BRAZILIAN_STATES, DEFAULT_CONFIG
 )
 from database import CloudSQLManager, DatabaseOperations, create_db_manager_from_env
@@ -27,16 +33,74 @@ from processed_tenders_tracker import (
     ProcessedTendersTracker, TenderIdentifier, get_processed_tenders_tracker
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
+logger = logging.getLogger(__name__)
+
+def setup_logging():
+    """Configure logging for a command-line run
+
+    Records are formatted by the QueueHandler on the calling thread, then written
+    to file/stderr by a listener thread so the event loop never blocks on log I/O.
+    Called only under __main__: classification workers are spawned processes that
+    re-import this module, and must not open the log file or start a listener.
+    """
+    log_queue = queue.SimpleQueue()
+    log_listener = QueueListener(
+        log_queue,
         logging.FileHandler('pncp_processing.log'),
         logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger(__name__)
+    )
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[QueueHandler(log_queue)]
+    )
+    log_listener.start()
+    atexit.register(log_listener.stop)
+
+# Highest-value tenders stored in the last week
+RECENT_TENDERS_EXPORT_SQL = """
+    SELECT t.id, t.title, t.cnpj, t.control_number, t.state_code, t.government_level,
+           t.total_homologated_value, t.publication_date, o.name as organization_name
+    FROM tenders t
+    JOIN organizations o ON t.organization_id = o.id
+    WHERE t.created_at >= CURRENT_DATE - INTERVAL '7 days'
+    AND t.total_homologated_value > 0
+    ORDER BY t.total_homologated_value DESC
+    LIMIT 50
+"""
+
+# Highest-value items stored in the last week, flagged when they have a product match
+RECENT_ITEMS_EXPORT_SQL = """
+    SELECT ti.id, ti.tender_id, ti.item_number, ti.description, ti.unit, ti.quantity,
+           ti.homologated_unit_value, ti.homologated_total_value, ti.winner_name,
+           t.state_code, o.name as organization_name,
+           CASE WHEN mp.id IS NOT NULL THEN true ELSE false END as has_match
+    FROM tender_items ti
+    JOIN tenders t ON ti.tender_id = t.id
+    JOIN organizations o ON t.organization_id = o.id
+    LEFT JOIN matched_products mp ON ti.id = mp.tender_item_id
+    WHERE ti.created_at >= CURRENT_DATE - INTERVAL '7 days'
+    AND ti.homologated_total_value > 0
+    ORDER BY ti.homologated_total_value DESC
+    LIMIT 100
+"""
+
+# Competitive product matches found in the last week
+COMPETITIVE_OPPORTUNITIES_EXPORT_SQL = """
+    SELECT mp.id, mp.fernandes_product_code, mp.fernandes_product_description,
+           mp.match_score, mp.fob_price_usd, mp.price_comparison_brl, mp.exchange_rate,
+           mp.price_difference_percent, mp.is_competitive,
+           ti.description as tender_item_description,
+           ti.quantity, t.state_code, o.name as organization_name
+    FROM matched_products mp
+    JOIN tender_items ti ON mp.tender_item_id = ti.id
+    JOIN tenders t ON ti.tender_id = t.id
+    JOIN organizations o ON t.organization_id = o.id
+    WHERE mp.is_competitive
+    AND mp.created_at >= CURRENT_DATE - INTERVAL '7 days'
+    ORDER BY mp.price_difference_percent DESC
+    LIMIT 50
+"""
 
 class PNCPMedicalProcessor:
     """Main orchestration class for PNCP medical data processing"""
@@ -111,7 +175,8 @@ class PNCPMedicalProcessor:
         self.api_client = PNCPAPIClient(username, password)
 
         # Test connection
-        success = await test_api_connection(username, password)
+        # Test on the client itself so its session and token carry over to processing
+        success = await test_api_connection(client=self.api_client)
         if not success:
             raise RuntimeError("Failed to connect to PNCP API")
 
@@ -142,13 +207,15 @@ class PNCPMedicalProcessor:
 
         self.classifier = TenderClassifier()
         self.product_matcher = ProductMatcher()
+        self.product_matcher.prepare_catalog(self.fernandes_products)
 
         self.discovery_engine = TenderDiscoveryEngine(
             self.api_client, self.classifier, self.db_ops, self.config
         )
 
         self.item_processor = ItemProcessor(
-            self.api_client, self.product_matcher, self.db_ops, self.fernandes_products
+            self.api_client, self.product_matcher, self.db_ops, self.fernandes_products,
+            usd_to_brl_rate=self.config.usd_to_brl_rate
         )
 
         logger.info("Processing components initialized")
@@ -164,23 +231,17 @@ class PNCPMedicalProcessor:
         logger.info(f"Starting tender discovery for {len(states)} states: {start_date} to {end_date}")
 
         if chunk_days > 0:
-            # Process in chunks to avoid API limits
-            chunk_results = await self.discovery_engine.discover_by_date_chunks(
+            # Process in chunks to avoid API limits, folding each chunk's
+            # statistics as it completes instead of collecting them all
+            total_stats = None
+            async for chunk_stats in self.discovery_engine.iter_discover_by_date_chunks(
                 start_date, end_date, chunk_days, states
-            )
-
-            # Combine statistics
-            total_stats = chunk_results[0] if chunk_results else None
-            for chunk_stats in chunk_results[1:]:
-                if total_stats:
-                    total_stats.total_found += chunk_stats.total_found
-                    total_stats.medical_relevant += chunk_stats.medical_relevant
-                    total_stats.processing_time_seconds += chunk_stats.processing_time_seconds
-                    total_stats.errors.extend(chunk_stats.errors)
-
-                    # Merge dictionaries
-                    for key, value in chunk_stats.by_state.items():
-                        total_stats.by_state[key] = total_stats.by_state.get(key, 0) + value
+            ):
+                if total_stats is None:
+                    total_stats = chunk_stats
+                else:
+                    total_stats.merge(chunk_stats)
+                    chunk_stats.errors.clear()
 
             return total_stats
         else:
@@ -189,8 +250,17 @@ class PNCPMedicalProcessor:
                 start_date, end_date, states
             )
 
-    async def process_tender_items(self, state_code: str = None, limit: int = 20):
-        """Process items for unprocessed tenders (limited to 20 per state to avoid duplicates)"""
+    async def process_tender_items(self, state_code: str = None, limit: int = 20,
+                                   semaphore: Optional[asyncio.Semaphore] = None,
+                                   pending_marks: Optional[List] = None):
+        """Process items for unprocessed tenders (limited to 20 per state to avoid duplicates)
+
+        semaphore, if given, is a tender concurrency budget shared with other states.
+        Tenders are marked in the tracker only once their item rows are flushed. With
+        pending_marks, the caller owns a shared item writer: (tenders, results,
+        state_code) is appended for it to mark after stopping that writer.
+        Otherwise this call runs its own writer and marks the tenders itself.
+        """
 
         if not self.item_processor or not self.tracker:
             raise RuntimeError("Item processor or tracker not initialized")
@@ -224,10 +294,44 @@ class PNCPMedicalProcessor:
         logger.info(f"Processing {len(unprocessed_tenders)} unprocessed tenders")
 
         # Process tenders
-        results = await self.item_processor.process_multiple_tenders(unprocessed_tenders)
+        owns_writer = pending_marks is None
+        unwritten_tender_ids = set()
+        if owns_writer:
+            await self.item_processor.start_item_writer()
+        try:
+            results = await self.item_processor.process_multiple_tenders(
+                unprocessed_tenders, max_concurrent=self.config.max_concurrent_tenders, semaphore=semaphore
+            )
+        finally:
+            if owns_writer:
+                unwritten_tender_ids = await self.item_processor.stop_item_writer()
+
+        if not owns_writer:
+            pending_marks.append((unprocessed_tenders, results, state_code))
+            return results
+
+        self.item_processor.record_unwritten_tenders(results, unwritten_tender_ids)
+        self._mark_tenders_processed(unprocessed_tenders, results, state_code, unwritten_tender_ids)
+        self.tracker.save_to_file()
+
+        return results
+
+    def _mark_tenders_processed(self, tenders: List[Dict], results: List, state_code: Optional[str],
+                                unwritten_tender_ids: Set[int]):
+        """Mark tenders whose item rows are in the database as processed in the tracker
+
+        Tenders whose processing raised, whose items request failed, or whose rows
+        the item writer failed to write are left unmarked, so a later run retries them.
+        """
+        # Failed tenders are dropped from results, so match them back by tender ID
+        results_by_id = {result.tender_id: result for result in results}
+
+        for tender in tenders:
+            result = results_by_id.get(tender.get('id'))
+            if (result is None or result.tender_id in unwritten_tender_ids
+                    or (result.errors and not result.total_items_found)):
+                continue
 
-        # Mark tenders as processed in tracker
-        for i, tender in enumerate(unprocessed_tenders):
             try:
                 tender_id = TenderIdentifier(
                     cnpj=tender.get('cnpj', ''),
@@ -236,34 +340,23 @@ class PNCPMedicalProcessor:
                     state_code=state_code or tender.get('state_code', '')
                 )
 
-                # Get result stats if available
-                result = results[i] if i < len(results) else None
-                items_count = result.total_items_found if result else 0
-                matches_found = result.matched_products if result else 0
-                status = "completed" if result and result.total_items_found > 0 else "no_items"
-
                 self.tracker.mark_as_processed(
                     tender_id,
                     homologated_value=tender.get('total_homologated_value', 0.0),
-                    items_count=items_count,
-                    matches_found=matches_found,
-                    status=status
+                    items_count=result.total_items_found,
+                    matches_found=result.matched_products,
+                    status="completed" if result.total_items_found > 0 else "no_items"
                 )
             except Exception as e:
                 logger.warning(f"Could not mark tender as processed: {e}")
 
-        # Save tracker state
-        self.tracker.save_to_file()
-
-        return results
-
     async def run_complete_workflow(self, start_date: str, end_date: str,
                                   states: List[str] = None, chunk_days: int = 7):
         """Run complete workflow: discovery -> item processing -> analysis"""
 
         logger.info("Starting complete PNCP medical data workflow")
 
-        workflow_start = datetime.now()
+        workflow_start = time.perf_counter()
 
         try:
             # Phase 1: Tender Discovery
@@ -279,23 +372,46 @@ class PNCPMedicalProcessor:
 
             # Phase 2: Item Processing
             logger.info("=== Phase 2: Item Processing ===")
-            item_results = []
-
-            # Process each state separately to manage memory
             states_to_process = states or self.config.enabled_states
-            for state in states_to_process:
+
+            # All states draw from one tender concurrency budget, so a state with few
+            # tenders leaves its slots to the others instead of idling them; each
+            # state's tenders are queued highest value first. The API client's
+            # rate limiter paces the combined request rate.
+            tender_semaphore = asyncio.Semaphore(self.config.max_concurrent_tenders)
+
+            # Tenders each state processed, marked in the tracker once the shared
+            # writer has flushed their rows
+            pending_marks = []
+
+            async def process_state(state):
                 logger.info(f"Processing items for {state}...")
-                state_results = await self.process_tender_items(state, limit=20)
-                item_results.extend(state_results)
+                return await self.process_tender_items(state, limit=20, semaphore=tender_semaphore,
+                                                       pending_marks=pending_marks)
 
-                # Small delay between states
-                await asyncio.sleep(1)
+            # One COPY writer and progress reporter shared by every state
+            await self.item_processor.start_item_writer()
+            await self.item_processor.start_progress_reporter()
+            try:
+                state_results = await asyncio.gather(
+                    *(process_state(state) for state in states_to_process)
+                )
+            finally:
+                await self.item_processor.stop_progress_reporter()
+                unwritten_tender_ids = await self.item_processor.stop_item_writer()
+
+            for tenders, results, state_code in pending_marks:
+                self.item_processor.record_unwritten_tenders(results, unwritten_tender_ids)
+                self._mark_tenders_processed(tenders, results, state_code, unwritten_tender_ids)
+            self.tracker.save_to_file()
+
+            item_results = [result for results in state_results for result in results]
 
             # Phase 3: Generate Reports
             logger.info("=== Phase 3: Generating Reports ===")
             await self.generate_reports(discovery_stats, item_results)
 
-            total_time = (datetime.now() - workflow_start).total_seconds()
+            total_time = time.perf_counter() - workflow_start
             logger.info(f"Complete workflow finished in {total_time:.1f} seconds")
 
         except Exception as e:
@@ -327,8 +443,9 @@ class PNCPMedicalProcessor:
 
         # Save report to file
         report_filename = f"pncp_medical_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        with open(report_filename, 'w') as f:
-            json.dump(reports, f, indent=2, default=str)
+        # Every value above is already a native int/float/str, so orjson needs no fallback
+        with open(report_filename, 'wb') as f:
+            f.write(orjson.dumps(reports, option=orjson.OPT_INDENT_2))
 
         logger.info(f"Report saved to {report_filename}")
 
@@ -355,79 +472,38 @@ class PNCPMedicalProcessor:
         try:
             logger.info("Preparing data for Notion export...")
 
-            # Fetch data from database for export
-            tenders_data = await self.get_recent_tenders_for_export()
-            items_data = await self.get_recent_items_for_export()
-            opportunities_data = await self.get_competitive_opportunities_for_export()
+            # Start the independent export queries concurrently on separate pooled
+            # connections; each Notion export begins as soon as its own rows arrive
+            fetches = [
+                asyncio.create_task(self.get_recent_tenders_for_export()),
+                asyncio.create_task(self.get_recent_items_for_export()),
+                asyncio.create_task(self.get_competitive_opportunities_for_export())
+            ]
 
             # Export to Notion
-            await export_to_notion(tenders_data, items_data, opportunities_data)
+            try:
+                await export_to_notion(*fetches)
+            finally:
+                for fetch in fetches:
+                    fetch.cancel()
 
         except Exception as e:
             logger.error(f"Notion export failed: {e}")
 
-    async def get_recent_tenders_for_export(self) -> List[Dict]:
+    async def get_recent_tenders_for_export(self) -> List[asyncpg.Record]:
         """Get recent tender data formatted for Notion export"""
-        conn = await self.db_manager.get_connection()
-        try:
-            rows = await conn.fetch("""
-                SELECT t.*, o.name as organization_name
-                FROM tenders t
-                JOIN organizations o ON t.organization_id = o.id
-                WHERE t.created_at >= CURRENT_DATE - INTERVAL '7 days'
-                AND t.total_homologated_value > 0
-                ORDER BY t.total_homologated_value DESC
-                LIMIT 50
-            """)
-
-            return [dict(row) for row in rows]
+        async with self.db_manager.acquire() as conn:
+            return await conn.fetch(RECENT_TENDERS_EXPORT_SQL)
 
-        finally:
-            await conn.close()
-
-    async def get_recent_items_for_export(self) -> List[Dict]:
+    async def get_recent_items_for_export(self) -> List[asyncpg.Record]:
         """Get recent item data formatted for Notion export"""
-        conn = await self.db_manager.get_connection()
-        try:
-            rows = await conn.fetch("""
-                SELECT ti.*, t.state_code, o.name as organization_name,
-                       CASE WHEN mp.id IS NOT NULL THEN true ELSE false END as has_match
-                FROM tender_items ti
-                JOIN tenders t ON ti.tender_id = t.id
-                JOIN organizations o ON t.organization_id = o.id
-                LEFT JOIN matched_products mp ON ti.id = mp.tender_item_id
-                WHERE ti.created_at >= CURRENT_DATE - INTERVAL '7 days'
-                AND ti.homologated_total_value > 0
-                ORDER BY ti.homologated_total_value DESC
-                LIMIT 100
-            """)
-
-            return [dict(row) for row in rows]
+        async with self.db_manager.acquire() as conn:
+            return await conn.fetch(RECENT_ITEMS_EXPORT_SQL)
 
-        finally:
-            await conn.close()
-
-    async def get_competitive_opportunities_for_export(self) -> List[Dict]:
+    async def get_competitive_opportunities_for_export(self) -> List[asyncpg.Record]:
         """Get competitive opportunities formatted for Notion export"""
-        conn = await self.db_manager.get_connection()
-        try:
-            rows = await conn.fetch("""
-                SELECT mp.*, ti.description as tender_item_description,
-                       ti.quantity, t.state_code, o.name as organization_name
-                FROM matched_products mp
-                JOIN tender_items ti ON mp.tender_item_id = ti.id
-                JOIN tenders t ON ti.tender_id = t.id
-                JOIN organizations o ON t.organization_id = o.id
-                WHERE mp.is_competitive = true
-                AND mp.created_at >= CURRENT_DATE - INTERVAL '7 days'
-                ORDER BY mp.price_difference_percent DESC
-                LIMIT 50
-            """)
-
-            return [dict(row) for row in rows]
-
-        finally:
-            await conn.close()
+        async with self.db_manager.acquire() as conn:
+            return await conn.fetch(COMPETITIVE_OPPORTUNITIES_EXPORT_SQL)
 
     async def export_data_to_csv(self, output_dir: str = "exports"):
         """Export processed data to CSV files"""
@@ -453,9 +529,15 @@ class PNCPMedicalProcessor:
         """Clean up resources"""
         logger.info("Cleaning up resources...")
 
+        if self.discovery_engine:
+            await self.discovery_engine.close()
+
         if self.api_client:
             await self.api_client.close_session()
 
+        if self.db_ops:
+            await self.db_ops.close()
+
         if self.db_manager:
             await self.db_manager.close()
 
@@ -465,12 +547,26 @@ class PNCPMedicalProcessor:
 
         logger.info("Cleanup completed")
 
+# CLI dates are YYYYMMDD
+DATE_ARG_PATTERN = re.compile(r'(\d{4})(\d{2})(\d{2})')
+
+def parse_date_arg(value: str) -> str:
+    """argparse type for YYYYMMDD dates; rejects bad input before any connections are opened"""
+    match = DATE_ARG_PATTERN.fullmatch(value)
+    if match:
+        try:
+            datetime(*map(int, match.groups()))
+            return value
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"invalid date '{value}', expected YYYYMMDD")
+
 async def main():
     """Main entry point"""
 
     parser = argparse.ArgumentParser(description='PNCP Medical Data Processor')
-    parser.add_argument('--start-date', required=True, help='Start date (YYYYMMDD)')
-    parser.add_argument('--end-date', required=True, help='End date (YYYYMMDD)')
+    parser.add_argument('--start-date', required=True, type=parse_date_arg, help='Start date (YYYYMMDD)')
+    parser.add_argument('--end-date', required=True, type=parse_date_arg, help='End date (YYYYMMDD)')
     parser.add_argument('--states', nargs='*', help='State codes to process (default: all)')
     parser.add_argument('--chunk-days', type=int, default=7, help='Days per processing chunk')
     parser.add_argument('--discovery-only', action='store_true', help='Only run discovery phase')
@@ -489,7 +585,7 @@ async def main():
 
     # Validate states
     if args.states:
-        invalid_states = [s for s in args.states if s not in get_state_codes()]
+        invalid_states = [s for s in args.states if s not in STATE_CODES]
         if invalid_states:
             logger.error(f"Invalid state codes: {invalid_states}")
             return
@@ -584,11 +680,28 @@ async def run_demo():
     except Exception as e:
         print(f"Demo setup failed (expected): {e}")
 
+def run_event_loop(coro):
+    """Run a coroutine on uvloop when it is available, else on the default asyncio loop"""
+    try:
+        import uvloop
+    except ImportError:
+        logger.debug("uvloop not installed, using the default asyncio event loop")
+        return asyncio.run(coro)
+
+    # uvloop.run (0.18+) avoids the global event loop policy, which asyncio deprecates
+    if hasattr(uvloop, 'run'):
+        return uvloop.run(coro)
+
+    uvloop.install()
+    return asyncio.run(coro)
+
 if __name__ == "__main__":
+    setup_logging()
+
     # Check if running in demo mode
     if len(os.sys.argv) == 1 or '--demo' in os.sys.argv:
-        asyncio.run(run_demo())
+        run_event_loop(run_demo())
     elif '--test' in os.sys.argv:
-        asyncio.run(test_setup())
+        run_event_loop(test_setup())
     else:
-        asyncio.run(main())
\ No newline at end of file
+        run_event_loop(main())
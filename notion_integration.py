@@ -6,14 +6,22 @@ Pushes tender results directly to Notion databases
 import os
 import json
 import asyncio
+import inspect
+import random
 import aiohttp
-from datetime import datetime
-from typing import Dict, List, Any, Optional
+import orjson
+from collections import deque
+from itertools import count, islice
+from datetime import date
+from typing import Dict, List, Any, Optional, Union, Awaitable, Deque, Iterable, AsyncIterator, Set, Tuple
 from dataclasses import dataclass
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Property values that never vary between pages; shared rather than rebuilt per row
+HOMOLOGATED_STATUS_PROPERTY = {"select": {"name": "Homologated"}}
+
 @dataclass
 class NotionConfig:
     """Notion integration configuration"""
@@ -24,67 +32,192 @@ class NotionConfig:
     BASE_URL: str = "https://api.notion.com/v1"
     API_VERSION: str = "2022-06-28"
 
+    # Notion allows an average of 3 requests per second per integration
+    MAX_CONCURRENT_REQUESTS: int = 3
+    REQUESTS_PER_SECOND: int = 3
+    MAX_RETRIES: int = 5
+
+    # Backoff for rate limits (429) and transient server errors
+    RETRY_DELAY: float = 1.0  # seconds
+    MAX_RETRY_DELAY: float = 30.0  # seconds, cap for exponential backoff
+    RETRY_STATUS_CODES: Tuple[int, ...] = (429, 500, 502, 503, 504)
+
+    # Keep-alive connection pool for api.notion.com
+    CONNECTION_LIMIT: int = 10
+    KEEPALIVE_TIMEOUT: int = 75
+    DNS_CACHE_TTL: int = 300
+
+    # Skip rows whose pages already exist; only pages matching the rows being
+    # exported are queried, not the whole database
+    SKIP_EXISTING_PAGES: bool = True
+    QUERY_PAGE_SIZE: int = 100  # Notion's maximum
+
+def create_notion_session(config: NotionConfig) -> aiohttp.ClientSession:
+    """HTTP session with Notion auth headers and a pooled keep-alive connector"""
+    connector = aiohttp.TCPConnector(
+        limit=config.CONNECTION_LIMIT,
+        limit_per_host=config.CONNECTION_LIMIT,
+        keepalive_timeout=config.KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=config.DNS_CACHE_TTL
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        headers={
+            "Authorization": f"Bearer {config.API_TOKEN}",
+            "Notion-Version": config.API_VERSION,
+            "Content-Type": "application/json"
+        }
+    )
+
 class NotionClient:
     """Notion API client for PNCP data integration"""
 
-    def __init__(self, config: NotionConfig = None):
+    def __init__(self, config: NotionConfig = None, session: Optional[aiohttp.ClientSession] = None):
+        """Create a client; pass a session to reuse its connection pool across clients"""
         self.config = config or NotionConfig()
-        self.session = None
+        self.session = session
+        self._owns_session = session is None
+
+        # Bounded in-flight requests plus a sliding one-second window of request starts
+        self._semaphore = asyncio.Semaphore(self.config.MAX_CONCURRENT_REQUESTS)
+        self._request_times: Deque[float] = deque(maxlen=self.config.REQUESTS_PER_SECOND)
+        self._rate_lock = asyncio.Lock()
 
     async def __aenter__(self):
-        self.session = aiohttp.ClientSession(
-            headers={
-                "Authorization": f"Bearer {self.config.API_TOKEN}",
-                "Notion-Version": self.config.API_VERSION,
-                "Content-Type": "application/json"
-            }
-        )
+        if self.session is None:
+            self.session = create_notion_session(self.config)
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.session:
+        # Injected sessions belong to the caller and outlive this client
+        if self.session and self._owns_session:
             await self.session.close()
+            self.session = None
+
+    async def _throttle(self):
+        """Wait until starting another request keeps within REQUESTS_PER_SECOND"""
+        async with self._rate_lock:
+            loop = asyncio.get_running_loop()
+            if len(self._request_times) == self._request_times.maxlen:
+                wait_time = 1.0 - (loop.time() - self._request_times[0])
+                if wait_time > 0:
+                    await asyncio.sleep(wait_time)
+            self._request_times.append(loop.time())
+
+    def _retry_delay(self, attempt: int, headers=None) -> float:
+        """Exponential backoff with jitter, preferring Notion's Retry-After header"""
+        if headers:
+            try:
+                return max(float(headers.get('Retry-After')), 0.0)
+            except (TypeError, ValueError):
+                pass
+
+        delay = min(2 ** attempt * self.config.RETRY_DELAY, self.config.MAX_RETRY_DELAY)
+        return delay + random.random()
 
-    async def create_page(self, database_id: str, properties: Dict[str, Any]) -> Dict:
-        """Create a new page in a Notion database"""
+    async def _request(self, method: str, url: str, body: bytes) -> Tuple[int, bytes]:
+        """Send a request within the rate limit, retrying rate limits, server errors and network failures"""
+        for attempt in range(self.config.MAX_RETRIES + 1):
+            try:
+                async with self._semaphore:
+                    await self._throttle()
+                    async with self.session.request(method, url, data=body) as response:
+                        # The last attempt falls through with its real status
+                        if (response.status not in self.config.RETRY_STATUS_CODES
+                                or attempt == self.config.MAX_RETRIES):
+                            return response.status, await response.read()
+                        status = response.status
+                        wait_time = self._retry_delay(attempt, response.headers)
+
+                if status == 429:
+                    logger.warning("Notion rate limited, retrying in %.1f seconds", wait_time)
+                else:
+                    logger.warning("Notion server error %s, retrying in %.1f seconds", status, wait_time)
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.config.MAX_RETRIES:
+                    raise
+                wait_time = self._retry_delay(attempt)
+                logger.warning("Notion request failed, retrying in %.1f seconds: %s", wait_time, e)
+
+            # Sleep outside the semaphore so other requests are not held up
+            await asyncio.sleep(wait_time)
+
+    async def create_page(self, database_id: str, properties: Dict[str, Any],
+                          parse_response: bool = True) -> Optional[Dict]:
+        """Create a new page in a Notion database; returns None if parse_response is False"""
         url = f"{self.config.BASE_URL}/pages"
         data = {
             "parent": {"database_id": database_id},
             "properties": properties
         }
 
-        async with self.session.post(url, json=data) as response:
-            if response.status == 200:
-                return await response.json()
-            else:
-                error_text = await response.text()
-                logger.error(f"Notion API error: {response.status} - {error_text}")
-                raise Exception(f"Notion API error: {response.status}")
+        # Serialized once; the session already sends Content-Type: application/json
+        status, content = await self._request('POST', url, orjson.dumps(data))
+        if status != 200:
+            logger.error("Notion API error: %s - %s", status, content.decode('utf-8', errors='replace'))
+            raise Exception(f"Notion API error: {status}")
 
-    async def query_database(self, database_id: str, filter_data: Dict = None) -> List[Dict]:
-        """Query a Notion database"""
-        url = f"{self.config.BASE_URL}/databases/{database_id}/query"
-        data = {"filter": filter_data} if filter_data else {}
+        return orjson.loads(content) if parse_response else None
 
-        async with self.session.post(url, json=data) as response:
-            if response.status == 200:
-                result = await response.json()
-                return result.get('results', [])
-            else:
-                logger.error(f"Query error: {response.status}")
-                return []
+    async def iter_database(self, database_id: str, filter_data: Dict = None,
+                            page_size: Optional[int] = None) -> AsyncIterator[Dict]:
+        """Yield every page of a Notion database as each result page arrives, following start_cursor"""
+        url = f"{self.config.BASE_URL}/databases/{database_id}/query"
+        data = {"page_size": min(page_size or self.config.QUERY_PAGE_SIZE, self.config.QUERY_PAGE_SIZE)}
+        if filter_data:
+            data["filter"] = filter_data
+
+        while True:
+            status, content = await self._request('POST', url, orjson.dumps(data))
+            if status != 200:
+                logger.error("Query error: %s", status)
+                return
+            result = orjson.loads(content)
+
+            for page in result.get('results', []):
+                yield page
+
+            if not result.get('has_more'):
+                return
+            data["start_cursor"] = result['next_cursor']
+
+    async def query_database(self, database_id: str, filter_data: Dict = None,
+                             limit: Optional[int] = None) -> List[Dict]:
+        """Query a Notion database across all result pages, up to limit pages if given"""
+        results = []
+        async for page in self.iter_database(database_id, filter_data, page_size=limit):
+            results.append(page)
+            if limit is not None and len(results) >= limit:
+                break
+        return results
 
     async def update_page(self, page_id: str, properties: Dict[str, Any]) -> Dict:
         """Update an existing page"""
         url = f"{self.config.BASE_URL}/pages/{page_id}"
         data = {"properties": properties}
 
-        async with self.session.patch(url, json=data) as response:
-            if response.status == 200:
-                return await response.json()
-            else:
-                logger.error(f"Update error: {response.status}")
-                raise Exception(f"Update failed: {response.status}")
+        status, content = await self._request('PATCH', url, orjson.dumps(data))
+        if status == 200:
+            return orjson.loads(content)
+        else:
+            logger.error(f"Update error: {status}")
+            raise Exception(f"Update failed: {status}")
+
+def _property_value(prop: Optional[Dict]) -> Any:
+    """Plain value of a page property as returned by a database query"""
+    if not prop:
+        return None
+    prop_type = prop.get('type')
+    value = prop.get(prop_type)
+    if prop_type in ('title', 'rich_text'):
+        return ''.join(part.get('plain_text', '') for part in value or [])
+    return value
+
+# Rows whose page creations are scheduled together; bounds pending payloads in memory
+EXPORT_BATCH_SIZE = 100
+# Values per "or" filter when looking up existing pages; Notion's limit for a compound filter
+EXISTING_KEYS_FILTER_SIZE = 100
 
 class NotionDataExporter:
     """Export PNCP data to Notion databases"""
@@ -92,133 +225,104 @@ class NotionDataExporter:
     def __init__(self, notion_client: NotionClient):
         self.notion = notion_client
 
-    def format_tender_properties(self, tender_data: Dict) -> Dict[str, Any]:
-        """Format tender data for Notion database"""
+    async def _existing_keys(self, database_id: str, key_properties: Tuple[str, ...],
+                             lookup_values: Iterable[str]) -> Set[Tuple]:
+        """Keys (values of key_properties) of pages already in a database
+
+        Only pages whose first key property (a rich_text) equals one of lookup_values
+        are queried, EXISTING_KEYS_FILTER_SIZE values per query, so the cost follows
+        the rows being exported rather than the size of the database.
+        """
+        if not self.notion.config.SKIP_EXISTING_PAGES:
+            return set()
+
+        lookup_values = sorted({value for value in lookup_values if value})
+        keys = set()
+        for start in range(0, len(lookup_values), EXISTING_KEYS_FILTER_SIZE):
+            filter_data = {"or": [
+                {"property": key_properties[0], "rich_text": {"equals": value}}
+                for value in lookup_values[start:start + EXISTING_KEYS_FILTER_SIZE]
+            ]}
+            async for page in self.notion.iter_database(database_id, filter_data):
+                properties = page.get('properties', {})
+                keys.add(tuple(_property_value(properties.get(name)) for name in key_properties))
+        logger.info("Found %d existing pages in Notion database %s", len(keys), database_id)
+        return keys
+
+    async def _export_in_batches(self, rows: Iterable[Dict], export_one) -> List[Any]:
+        """Run export_one over rows, EXPORT_BATCH_SIZE at a time; rows may be a generator"""
+        results = []
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, EXPORT_BATCH_SIZE))
+            if not batch:
+                return results
+            results.extend(await asyncio.gather(*(export_one(row) for row in batch)))
+
+    def format_tender_properties(self, tender_data: Dict, today: Optional[str] = None) -> Dict[str, Any]:
+        """Format tender data for Notion database; pass today to reuse one date across a batch"""
+        get = tender_data.get
+        if today is None:
+            today = date.today().isoformat()
         return {
-            "Title": {
-                "title": [{"text": {"content": tender_data.get('title', 'Untitled Tender')[:100]}}]
-            },
-            "Organization": {
-                "rich_text": [{"text": {"content": tender_data.get('organization_name', '')[:2000]}}]
-            },
-            "CNPJ": {
-                "rich_text": [{"text": {"content": tender_data.get('cnpj', '')}}]
-            },
-            "State": {
-                "select": {"name": tender_data.get('state_code', 'N/A')}
-            },
-            "Government Level": {
-                "select": {"name": tender_data.get('government_level', 'Unknown')}
-            },
-            "Total Value (R$)": {
-                "number": float(tender_data.get('total_homologated_value', 0))
-            },
-            "Publication Date": {
-                "date": {"start": tender_data.get('publication_date', datetime.now().isoformat()[:10])}
-            },
-            "Status": {
-                "select": {"name": "Homologated"}
-            },
-            "Items Count": {
-                "number": tender_data.get('items_count', 0)
-            },
-            "Matches Found": {
-                "number": tender_data.get('matches_count', 0)
-            },
-            "Processed Date": {
-                "date": {"start": datetime.now().isoformat()[:10]}
-            }
+            "Title": {"title": [{"text": {"content": get('title', 'Untitled Tender')[:100]}}]},
+            "Organization": {"rich_text": [{"text": {"content": get('organization_name', '')[:2000]}}]},
+            "CNPJ": {"rich_text": [{"text": {"content": get('cnpj', '')}}]},
+            "Control Number": {"rich_text": [{"text": {"content": get('control_number') or ''}}]},
+            "State": {"select": {"name": get('state_code', 'N/A')}},
+            "Government Level": {"select": {"name": get('government_level', 'Unknown')}},
+            "Total Value (R$)": {"number": float(get('total_homologated_value', 0))},
+            "Publication Date": {"date": {"start": get('publication_date', today)}},
+            "Status": HOMOLOGATED_STATUS_PROPERTY,
+            "Items Count": {"number": get('items_count', 0)},
+            "Matches Found": {"number": get('matches_count', 0)},
+            "Processed Date": {"date": {"start": today}}
         }
 
     def format_item_properties(self, item_data: Dict) -> Dict[str, Any]:
         """Format item data for Notion database"""
+        get = item_data.get
         return {
-            "Description": {
-                "title": [{"text": {"content": item_data.get('description', 'No description')[:100]}}]
-            },
-            "Tender ID": {
-                "rich_text": [{"text": {"content": str(item_data.get('tender_id', ''))}}]
-            },
-            "Organization": {
-                "rich_text": [{"text": {"content": item_data.get('organization_name', '')[:100]}}]
-            },
-            "Item Number": {
-                "number": item_data.get('item_number', 0)
-            },
-            "Unit": {
-                "rich_text": [{"text": {"content": item_data.get('unit', '')}}]
-            },
-            "Quantity": {
-                "number": float(item_data.get('quantity', 0))
-            },
-            "Unit Price (R$)": {
-                "number": float(item_data.get('homologated_unit_value', 0))
-            },
-            "Total Price (R$)": {
-                "number": float(item_data.get('homologated_total_value', 0))
-            },
-            "Winner": {
-                "rich_text": [{"text": {"content": item_data.get('winner_name', '')[:100]}}]
-            },
-            "State": {
-                "select": {"name": item_data.get('state_code', 'N/A')}
-            },
-            "Has Match": {
-                "checkbox": bool(item_data.get('has_match', False))
-            }
+            "Description": {"title": [{"text": {"content": get('description', 'No description')[:100]}}]},
+            "Tender ID": {"rich_text": [{"text": {"content": str(get('tender_id', ''))}}]},
+            "Organization": {"rich_text": [{"text": {"content": get('organization_name', '')[:100]}}]},
+            "Item Number": {"number": get('item_number', 0)},
+            "Unit": {"rich_text": [{"text": {"content": get('unit', '')}}]},
+            "Quantity": {"number": float(get('quantity', 0))},
+            "Unit Price (R$)": {"number": float(get('homologated_unit_value', 0))},
+            "Total Price (R$)": {"number": float(get('homologated_total_value', 0))},
+            "Winner": {"rich_text": [{"text": {"content": get('winner_name', '')[:100]}}]},
+            "State": {"select": {"name": get('state_code', 'N/A')}},
+            "Has Match": {"checkbox": bool(get('has_match', False))}
         }
 
     def format_opportunity_properties(self, opportunity_data: Dict) -> Dict[str, Any]:
         """Format competitive opportunity data for Notion database"""
+        get = opportunity_data.get
+        fob_price = get('fob_price_usd', 0)
+        exchange_rate = get('exchange_rate', 5.0)
+        quantity = get('quantity', 0)
+        price_difference = get('price_difference_percent', 0)
         return {
-            "Product": {
-                "title": [{"text": {"content": opportunity_data.get('fernandes_product_description', 'Unknown Product')[:100]}}]
-            },
-            "Fernandes Code": {
-                "rich_text": [{"text": {"content": opportunity_data.get('fernandes_product_code', '')}}]
-            },
-            "Tender Description": {
-                "rich_text": [{"text": {"content": opportunity_data.get('tender_item_description', '')[:500]}}]
-            },
-            "Organization": {
-                "rich_text": [{"text": {"content": opportunity_data.get('organization_name', '')[:100]}}]
-            },
-            "Match Score": {
-                "number": float(opportunity_data.get('match_score', 0))
-            },
-            "FOB Price (USD)": {
-                "number": float(opportunity_data.get('fob_price_usd', 0))
-            },
-            "Market Price (R$)": {
-                "number": float(opportunity_data.get('price_comparison_brl', 0))
-            },
-            "Our Price (R$)": {
-                "number": float(opportunity_data.get('fob_price_usd', 0) * opportunity_data.get('exchange_rate', 5.0))
-            },
-            "Price Difference (%)": {
-                "number": float(opportunity_data.get('price_difference_percent', 0))
-            },
-            "Competitive": {
-                "checkbox": bool(opportunity_data.get('is_competitive', False))
-            },
-            "State": {
-                "select": {"name": opportunity_data.get('state_code', 'N/A')}
-            },
-            "Opportunity Score": {
-                "select": {
-                    "name": self._get_opportunity_score(opportunity_data.get('price_difference_percent', 0))
-                }
-            },
-            "Quantity": {
-                "number": float(opportunity_data.get('quantity', 0))
-            },
-            "Potential Revenue (R$)": {
-                "number": float(opportunity_data.get('quantity', 0) * opportunity_data.get('fob_price_usd', 0) * opportunity_data.get('exchange_rate', 5.0))
-            }
+            "Product": {"title": [{"text": {"content": get('fernandes_product_description', 'Unknown Product')[:100]}}]},
+            "Fernandes Code": {"rich_text": [{"text": {"content": get('fernandes_product_code', '')}}]},
+            "Tender Description": {"rich_text": [{"text": {"content": get('tender_item_description', '')[:500]}}]},
+            "Organization": {"rich_text": [{"text": {"content": get('organization_name', '')[:100]}}]},
+            "Match Score": {"number": float(get('match_score', 0))},
+            "FOB Price (USD)": {"number": float(fob_price)},
+            "Market Price (R$)": {"number": float(get('price_comparison_brl', 0))},
+            "Our Price (R$)": {"number": float(fob_price * exchange_rate)},
+            "Price Difference (%)": {"number": float(price_difference)},
+            "Competitive": {"checkbox": bool(get('is_competitive', False))},
+            "State": {"select": {"name": get('state_code', 'N/A')}},
+            "Opportunity Score": {"select": {"name": self._get_opportunity_score(price_difference)}},
+            "Quantity": {"number": float(quantity)},
+            "Potential Revenue (R$)": {"number": float(quantity * fob_price * exchange_rate)}
         }
 
-    def _get_opportunity_score(self, price_diff: float) -> str:
-        """Convert price difference to opportunity score"""
+    @staticmethod
+    def _get_opportunity_score(price_diff: float) -> str:
+        """Convert price difference to opportunity score (three comparisons; cheaper than a cache lookup)"""
         if price_diff >= 50:
             return "🟢 High"
         elif price_diff >= 25:
@@ -234,24 +338,33 @@ class NotionDataExporter:
             logger.warning("Tenders database ID not configured")
             return 0
 
-        exported = 0
-        for tender in tenders:
-            try:
-                properties = self.format_tender_properties(tender)
-                await self.notion.create_page(
-                    self.notion.config.TENDERS_DATABASE_ID,
-                    properties
-                )
-                exported += 1
-                logger.info(f"Exported tender: {tender.get('title', 'Unknown')[:50]}")
+        today = date.today().isoformat()
+        # Resolved once per export rather than per row
+        database_id = self.notion.config.TENDERS_DATABASE_ID
+
+        # Tenders are identified in Notion by their PNCP control number (unique per
+        # tender, unlike title); rows without one are always exported
+        existing = await self._existing_keys(database_id, ("Control Number",),
+                                             (t.get('control_number') for t in tenders))
+        if existing:
+            tenders = [t for t in tenders if (t.get('control_number') or '',) not in existing]
+        format_properties = self.format_tender_properties
+        create_page = self.notion.create_page
 
-                # Rate limiting - Notion API allows 3 requests per second
-                await asyncio.sleep(0.4)
+        async def export_one(tender):
+            try:
+                properties = format_properties(tender, today)
+                await create_page(database_id, properties, parse_response=False)
+                logger.info("Exported tender: %s", tender.get('title', 'Unknown')[:50])
+                return True
 
             except Exception as e:
                 logger.error(f"Failed to export tender {tender.get('id', 'unknown')}: {e}")
+                return False
 
-        return exported
+        # The client bounds concurrency and paces requests to Notion's rate limit
+        results = await self._export_in_batches(tenders, export_one)
+        return sum(results)
 
     async def export_items(self, items: List[Dict]) -> int:
         """Export items to Notion database"""
@@ -259,25 +372,34 @@ class NotionDataExporter:
             logger.warning("Items database ID not configured")
             return 0
 
-        exported = 0
-        for item in items:
-            try:
-                properties = self.format_item_properties(item)
-                await self.notion.create_page(
-                    self.notion.config.ITEMS_DATABASE_ID,
-                    properties
-                )
-                exported += 1
+        database_id = self.notion.config.ITEMS_DATABASE_ID
 
-                if exported % 10 == 0:
-                    logger.info(f"Exported {exported} items...")
+        # Items are identified in Notion by tender ID and item number
+        existing = await self._existing_keys(database_id, ("Tender ID", "Item Number"),
+                                             (str(i.get('tender_id', '')) for i in items))
+        if existing:
+            items = [i for i in items
+                     if (str(i.get('tender_id', '')), i.get('item_number', 0)) not in existing]
+        format_properties = self.format_item_properties
+        create_page = self.notion.create_page
+        # Progress counter; next() needs no nonlocal rebinding between tasks
+        exported_so_far = count(1)
 
-                await asyncio.sleep(0.4)
+        async def export_one(item):
+            try:
+                properties = format_properties(item)
+                await create_page(database_id, properties, parse_response=False)
+                exported = next(exported_so_far)
+                if exported % 10 == 0:
+                    logger.info("Exported %d items...", exported)
+                return True
 
             except Exception as e:
                 logger.error(f"Failed to export item {item.get('id', 'unknown')}: {e}")
+                return False
 
-        return exported
+        results = await self._export_in_batches(items, export_one)
+        return sum(results)
 
     async def export_opportunities(self, opportunities: List[Dict]) -> int:
         """Export competitive opportunities to Notion database"""
@@ -285,29 +407,47 @@ class NotionDataExporter:
             logger.warning("Opportunities database ID not configured")
             return 0
 
-        # Filter for competitive opportunities only
-        competitive_ops = [op for op in opportunities if op.get('is_competitive', False)]
+        if not opportunities:
+            return 0
 
-        exported = 0
-        for opp in competitive_ops:
-            try:
-                properties = self.format_opportunity_properties(opp)
-                await self.notion.create_page(
-                    self.notion.config.OPPORTUNITIES_DATABASE_ID,
-                    properties
-                )
-                exported += 1
-                logger.info(f"Exported opportunity: {opp.get('fernandes_product_code', 'Unknown')}")
+        # Filter for competitive opportunities only, lazily as batches are taken
+        competitive_ops = (op for op in opportunities if op.get('is_competitive', False))
+
+        database_id = self.notion.config.OPPORTUNITIES_DATABASE_ID
+        format_properties = self.format_opportunity_properties
+        create_page = self.notion.create_page
 
-                await asyncio.sleep(0.4)
+        async def export_one(opp):
+            try:
+                properties = format_properties(opp)
+                await create_page(database_id, properties, parse_response=False)
+                logger.info("Exported opportunity: %s", opp.get('fernandes_product_code', 'Unknown'))
+                return True
 
             except Exception as e:
                 logger.error(f"Failed to export opportunity {opp.get('id', 'unknown')}: {e}")
+                return False
+
+        results = await self._export_in_batches(competitive_ops, export_one)
+        return sum(results)
+
+Rows = Union[List[Dict], Awaitable[List[Dict]]]
+
+async def _resolve_rows(rows: Rows) -> List[Dict]:
+    """Await rows that are still being fetched"""
+    if inspect.isawaitable(rows):
+        return await rows
+    return rows
 
-        return exported
+async def export_to_notion(tenders: Rows, items: Rows, opportunities: Rows,
+                           session: Optional[aiohttp.ClientSession] = None):
+    """Main function to export all data to Notion
 
-async def export_to_notion(tenders: List[Dict], items: List[Dict], opportunities: List[Dict]):
-    """Main function to export all data to Notion"""
+    Each argument may be a list or an awaitable (e.g. a running fetch task).
+    Awaitables are resolved only when their export starts, so tenders can be
+    written while the items and opportunities queries are still running.
+    Pass a session from create_notion_session to reuse connections across runs.
+    """
     config = NotionConfig()
 
     # Validate configuration
@@ -315,27 +455,30 @@ async def export_to_notion(tenders: List[Dict], items: List[Dict], opportunities
         logger.error("NOTION_API_TOKEN not configured")
         return
 
-    async with NotionClient(config) as notion:
+    async with NotionClient(config, session=session) as notion:
         exporter = NotionDataExporter(notion)
 
-        print("🔗 Exporting to Notion...")
+        logger.info("Exporting to Notion...")
 
         # Export tenders
+        tenders = await _resolve_rows(tenders)
         if config.TENDERS_DATABASE_ID and tenders:
             tender_count = await exporter.export_tenders(tenders)
-            print(f"✅ Exported {tender_count} tenders")
+            logger.info("Exported %d tenders", tender_count)
 
         # Export items
+        items = await _resolve_rows(items)
         if config.ITEMS_DATABASE_ID and items:
             item_count = await exporter.export_items(items)
-            print(f"✅ Exported {item_count} items")
+            logger.info("Exported %d items", item_count)
 
         # Export opportunities
+        opportunities = await _resolve_rows(opportunities)
         if config.OPPORTUNITIES_DATABASE_ID and opportunities:
             opp_count = await exporter.export_opportunities(opportunities)
-            print(f"✅ Exported {opp_count} competitive opportunities")
+            logger.info("Exported %d competitive opportunities", opp_count)
 
-        print("🎉 Notion export complete!")
+        logger.info("Notion export complete")
 
 # Example usage and testing
 async def test_notion_connection():
@@ -350,7 +493,7 @@ async def test_notion_connection():
         async with NotionClient(config) as notion:
             # Test with a simple database query
             if config.TENDERS_DATABASE_ID:
-                results = await notion.query_database(config.TENDERS_DATABASE_ID)
+                results = await notion.query_database(config.TENDERS_DATABASE_ID, limit=config.QUERY_PAGE_SIZE)
                 print(f"✅ Connection successful! Found {len(results)} existing records")
                 return True
             else:
@@ -6,12 +6,14 @@ Handles all interactions with the PNCP API including login, token management, an
 import asyncio
 import aiohttp
 import json
+import orjson
 import logging
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Dict, List, Optional, Any, Tuple, Union, AsyncIterator
 from dataclasses import dataclass, asdict
 import time
 import os
+import random
 from config import APIConfig, ProcessingConfig
 
 logger = logging.getLogger(__name__)
@@ -47,6 +49,15 @@ class AuthToken:
             user_id=data.get('user_id')
         )
 
+def extract_data_list(response: Any) -> List[Dict[str, Any]]:
+    """Normalize an API payload (bare list or {'data': [...]}) into a list of record dicts"""
+    if isinstance(response, dict):
+        response = response.get('data') or []
+    if not isinstance(response, list):
+        return []
+    # One pass here instead of per-record type guards downstream
+    return [record for record in response if type(record) is dict]
+
 class RateLimiter:
     """Simple rate limiter for API requests"""
 
@@ -55,10 +66,21 @@ class RateLimiter:
         self.max_per_hour = max_requests_per_hour
         self.minute_requests = []
         self.hour_requests = []
+        self.paused_until = 0.0
+
+    def pause(self, seconds: float):
+        """Hold all requests for the given time, e.g. after the server answers 429"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
 
     async def wait_if_needed(self):
         """Wait if rate limits would be exceeded"""
-        now = time.time()
+        # Monotonic clock: request windows are intervals and must not jump with wall time
+        now = time.monotonic()
+
+        # Honor a server-imposed pause shared by all requests
+        if self.paused_until > now:
+            await asyncio.sleep(self.paused_until - now)
+            now = time.monotonic()
 
         # Clean old requests
         self.minute_requests = [req_time for req_time in self.minute_requests if now - req_time < 60]
@@ -68,7 +90,7 @@ class RateLimiter:
         if len(self.minute_requests) >= self.max_per_minute:
             sleep_time = 60 - (now - self.minute_requests[0])
             if sleep_time > 0:
-                logger.warning(f"Rate limit reached, sleeping for {sleep_time:.1f} seconds")
+                logger.warning("Rate limit reached, sleeping for %.1f seconds", sleep_time)
                 await asyncio.sleep(sleep_time)
                 return await self.wait_if_needed()
 
@@ -76,7 +98,7 @@ class RateLimiter:
         if len(self.hour_requests) >= self.max_per_hour:
             sleep_time = 3600 - (now - self.hour_requests[0])
             if sleep_time > 0:
-                logger.warning(f"Hourly rate limit reached, sleeping for {sleep_time:.1f} seconds")
+                logger.warning("Hourly rate limit reached, sleeping for %.1f seconds", sleep_time)
                 await asyncio.sleep(sleep_time)
                 return await self.wait_if_needed()
 
@@ -110,10 +132,17 @@ class PNCPAPIClient:
         await self.close_session()
 
     async def start_session(self):
-        """Initialize HTTP session"""
+        """Initialize the shared HTTP session and its keep-alive connection pool"""
         if self.session is None:
             timeout = aiohttp.ClientTimeout(total=APIConfig.REQUEST_TIMEOUT)
+            connector = aiohttp.TCPConnector(
+                limit=APIConfig.CONNECTION_LIMIT,
+                limit_per_host=APIConfig.CONNECTION_LIMIT_PER_HOST,
+                ttl_dns_cache=APIConfig.DNS_CACHE_TTL,
+                keepalive_timeout=APIConfig.KEEPALIVE_TIMEOUT
+            )
             self.session = aiohttp.ClientSession(
+                connector=connector,
                 timeout=timeout,
                 headers={'User-Agent': 'PNCP-Medical-Data-Client/1.0'}
             )
@@ -124,15 +153,31 @@ class PNCPAPIClient:
             await self.session.close()
             self.session = None
 
-    async def _make_request(self, method: str, url: str, **kwargs) -> Tuple[int, Dict[str, Any]]:
-        """Make HTTP request with rate limiting and error handling"""
-        await self.rate_limiter.wait_if_needed()
+    def _retry_delay(self, attempt: int, headers=None) -> float:
+        """Exponential backoff with jitter, preferring the server's rate-limit headers"""
+        if headers:
+            retry_after = headers.get('Retry-After') or headers.get('X-RateLimit-Reset')
+            try:
+                delay = float(retry_after)
+                # X-RateLimit-Reset may be an epoch timestamp rather than a delay
+                if delay > time.time():
+                    delay -= time.time()
+                return max(delay, 0.0)
+            except (TypeError, ValueError):
+                pass
 
+        delay = min(2 ** attempt * APIConfig.RETRY_DELAY, APIConfig.MAX_RETRY_DELAY)
+        return delay + random.random()
+
+    async def _make_request(self, method: str, url: str, **kwargs) -> Tuple[int, Dict[str, Any]]:
+        """Make HTTP request with rate limiting, retry with backoff and error handling"""
         if not self.session:
             await self.start_session()
 
         retries = 0
         while retries < APIConfig.MAX_RETRIES:
+            await self.rate_limiter.wait_if_needed()
+
             try:
                 async with self.session.request(method, url, **kwargs) as response:
                     if response.status == 401 and self.auth_token:
@@ -146,29 +191,36 @@ class PNCPAPIClient:
                         # Retry the request
                         continue
 
-                    if response.status == 429:  # Rate limited
-                        wait_time = min(2 ** retries * APIConfig.RETRY_DELAY, 60)
-                        logger.warning(f"Rate limited, waiting {wait_time} seconds")
-                        await asyncio.sleep(wait_time)
+                    # Retry transient failures; the last attempt falls through with its real status
+                    if response.status in APIConfig.RETRY_STATUS_CODES and retries + 1 < APIConfig.MAX_RETRIES:
                         retries += 1
+                        wait_time = self._retry_delay(retries, response.headers)
+                        if response.status == 429:
+                            # Hold every request on this client, not just this one
+                            self.rate_limiter.pause(wait_time)
+                            logger.warning("Rate limited, waiting %.1f seconds", wait_time)
+                        else:
+                            logger.warning("Server error %s, retrying in %.1f seconds", response.status, wait_time)
+                        await asyncio.sleep(wait_time)
                         continue
 
-                    # Try to parse JSON response
+                    # Decode the raw body with orjson rather than aiohttp's stdlib json path
+                    body = await response.read()
                     try:
-                        data = await response.json()
-                    except:
-                        data = {'error': 'Invalid JSON response', 'text': await response.text()}
+                        data = orjson.loads(body)
+                    except orjson.JSONDecodeError:
+                        data = {'error': 'Invalid JSON response', 'text': body.decode('utf-8', errors='replace')}
 
                     return response.status, data
 
             except Exception as e:
                 retries += 1
                 if retries >= APIConfig.MAX_RETRIES:
-                    logger.error(f"Request failed after {retries} retries: {e}")
+                    logger.error("Request failed after %d retries: %s", retries, e)
                     return 500, {'error': str(e)}
 
-                wait_time = 2 ** retries * APIConfig.RETRY_DELAY
-                logger.warning(f"Request failed, retrying in {wait_time} seconds: {e}")
+                wait_time = self._retry_delay(retries)
+                logger.warning("Request failed, retrying in %.1f seconds: %s", wait_time, e)
                 await asyncio.sleep(wait_time)
 
         return 500, {'error': 'Max retries exceeded'}
@@ -270,6 +322,38 @@ class PNCPAPIClient:
 
         return await self._make_request('GET', url, headers=headers)
 
+    async def get_items_results(self, cnpj: str, year: int, sequential: int,
+                                item_numbers: List[int],
+                                max_concurrent: Optional[int] = None) -> List[Union[Tuple[int, Dict[str, Any]], BaseException]]:
+        """Get results (bids) for several items of one tender
+
+        PNCP has no batch endpoint for item results, so this authenticates once and
+        issues the per-item requests concurrently over the pooled session, at most
+        max_concurrent in flight. Responses come back in item_numbers order; a
+        request that raised is returned as its exception.
+        """
+        if not item_numbers:
+            return []
+
+        if not self.auth_token or self.auth_token.is_expired():
+            authenticated = await self.authenticate()
+            if not authenticated:
+                return [(401, {'error': 'Authentication failed'})] * len(item_numbers)
+
+        items_url = f"{self.base_url}/v1/orgaos/{cnpj}/compras/{year}/{sequential}/itens"
+        headers = self._get_auth_headers()
+        semaphore = asyncio.Semaphore(max_concurrent or APIConfig.MAX_CONCURRENT_ITEM_REQUESTS)
+        make_request = self._make_request
+
+        async def get_results(item_number):
+            async with semaphore:
+                # Each request gets its own headers dict; _make_request rewrites it on token refresh
+                return await make_request('GET', f"{items_url}/{item_number}/resultados",
+                                          headers=dict(headers))
+
+        return await asyncio.gather(*(get_results(n) for n in item_numbers),
+                                    return_exceptions=True)
+
     async def get_specific_item_result(self, cnpj: str, year: int, sequential: int,
                                      item_number: int, result_sequential: int) -> Tuple[int, Dict[str, Any]]:
         """Get specific result details for an item"""
@@ -289,44 +373,75 @@ class PNCPAPIClient:
         if modalities is None:
             modalities = [4, 6, 8]  # Electronic tenders, Pregão, Dispensa
 
-        all_tenders = []
+        # Modalities page independently, so they are fetched concurrently; the
+        # rate limiter paces the combined requests instead of fixed sleeps
+        modality_tenders = await asyncio.gather(*(
+            self._discover_modality_tenders(state_code, start_date, end_date, modality)
+            for modality in modalities
+        ))
 
-        for modality in modalities:
-            page = 1
-            has_more = True
+        all_tenders = [tender for tenders in modality_tenders for tender in tenders]
 
-            while has_more:
-                try:
-                    status, response = await self.get_tenders_by_publication_date(
-                        start_date, end_date, modality, state_code, page=page
-                    )
+        logger.info(f"Discovered {len(all_tenders)} tenders for {state_code}")
+        return all_tenders
 
-                    if status == 200:
-                        data = response.get('data', [])
-                        if data:
-                            all_tenders.extend(data)
+    async def iter_tenders_for_state(self, state_code: str, start_date: str, end_date: str,
+                                     modalities: List[int] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield each modality's tenders for a state as soon as that modality is paged through
 
-                            # Check if there are more pages
-                            pages_remaining = response.get('paginasRestantes', 0)
-                            has_more = pages_remaining > 0
-                            page += 1
+        Modalities are fetched concurrently as in discover_tenders_for_state, but callers
+        can start on the first finished modality while the others are still paging.
+        """
+        if modalities is None:
+            modalities = [4, 6, 8]  # Electronic tenders, Pregão, Dispensa
 
-                            logger.info(f"Retrieved page {page-1} for {state_code}, modality {modality}: {len(data)} tenders")
-                        else:
-                            has_more = False
-                    else:
-                        logger.error(f"Failed to get tenders for {state_code}, modality {modality}: {status} - {response}")
-                        has_more = False
+        fetches = [
+            asyncio.ensure_future(self._discover_modality_tenders(state_code, start_date, end_date, modality))
+            for modality in modalities
+        ]
+        try:
+            for next_done in asyncio.as_completed(fetches):
+                yield await next_done
+        finally:
+            # Stop paging the remaining modalities if the caller stops early or fails
+            for fetch in fetches:
+                fetch.cancel()
+
+    async def _discover_modality_tenders(self, state_code: str, start_date: str, end_date: str,
+                                         modality: int) -> List[Dict[str, Any]]:
+        """Page through the tenders of one modality for a state"""
+        tenders = []
+        page = 1
+        has_more = True
+
+        while has_more:
+            try:
+                status, response = await self.get_tenders_by_publication_date(
+                    start_date, end_date, modality, state_code, page=page
+                )
+
+                if status == 200:
+                    data = extract_data_list(response)
+                    if data:
+                        tenders.extend(data)
 
-                    # Small delay between pages to be respectful
-                    await asyncio.sleep(0.1)
+                        # Check if there are more pages
+                        pages_remaining = response.get('paginasRestantes', 0)
+                        has_more = pages_remaining > 0
+                        page += 1
 
-                except Exception as e:
-                    logger.error(f"Error getting tenders for {state_code}: {e}")
+                        logger.info("Retrieved page %d for %s, modality %s: %d tenders", page - 1, state_code, modality, len(data))
+                    else:
+                        has_more = False
+                else:
+                    logger.error("Failed to get tenders for %s, modality %s: %s - %s", state_code, modality, status, response)
                     has_more = False
 
-        logger.info(f"Discovered {len(all_tenders)} tenders for {state_code}")
-        return all_tenders
+            except Exception as e:
+                logger.error(f"Error getting tenders for {state_code}: {e}")
+                has_more = False
+
+        return tenders
 
     async def get_complete_tender_data(self, cnpj: str, year: int, sequential: int) -> Dict[str, Any]:
         """Get complete tender data including items and results"""
@@ -343,33 +458,36 @@ class PNCPAPIClient:
             status, items_response = await self.get_tender_items(cnpj, year, sequential)
 
             if status == 200:
-                items = items_response.get('data', [])
-
-                for item in items:
-                    item_number = item.get('numeroItem')
-                    if item_number:
-                        # Get item results
-                        results_status, results_response = await self.get_item_results(
-                            cnpj, year, sequential, item_number
-                        )
-
-                        if results_status == 200:
-                            item['results'] = results_response.get('data', [])
-                        else:
-                            item['results'] = []
-                            item['results_error'] = f"Status {results_status}: {results_response}"
+                items = extract_data_list(items_response)
+
+                # Fetch results for every numbered item in one batch rather than
+                # one item at a time with a delay between them
+                numbered_items = [item for item in items if item.get('numeroItem')]
+                results_responses = await self.get_items_results(
+                    cnpj, year, sequential, [item['numeroItem'] for item in numbered_items]
+                )
+
+                for item, results_response in zip(numbered_items, results_responses):
+                    if isinstance(results_response, BaseException):
+                        item['results'] = []
+                        item['results_error'] = f"Exception: {results_response}"
+                        continue
 
-                    tender_data['items'].append(item)
+                    results_status, results_data = results_response
+                    if results_status == 200:
+                        item['results'] = extract_data_list(results_data)
+                    else:
+                        item['results'] = []
+                        item['results_error'] = f"Status {results_status}: {results_data}"
 
-                    # Small delay between item requests
-                    await asyncio.sleep(0.05)
+                tender_data['items'].extend(items)
 
             else:
                 tender_data['error'] = f"Failed to get items: {status} - {items_response}"
 
         except Exception as e:
             tender_data['error'] = f"Exception getting tender data: {str(e)}"
-            logger.error(f"Error getting complete tender data for {cnpj}/{year}/{sequential}: {e}")
+            logger.error("Error getting complete tender data for %s/%s/%s: %s", cnpj, year, sequential, e)
 
         return tender_data
 
@@ -400,29 +518,41 @@ class PNCPAPIClient:
 
 
 # Utility functions
-async def test_api_connection(username: str = None, password: str = None) -> bool:
-    """Test API connection and authentication"""
+async def test_api_connection(username: str = None, password: str = None,
+                              client: Optional[PNCPAPIClient] = None) -> bool:
+    """Test API connection and authentication
+
+    Pass an existing client to test it in place; its session, warm connections
+    and auth token are then kept for the requests that follow.
+    """
+    if client is not None:
+        return await _check_api_connection(client)
+
     async with PNCPAPIClient(username, password) as client:
-        success = await client.authenticate()
-        if success:
-            # Test a simple consultation API call
-            status, response = await client.get_tenders_by_publication_date(
-                start_date='20240101',
-                end_date='20240102',
-                modality_code=8,  # Dispensa
-                state='DF',
-                page=1
-            )
+        return await _check_api_connection(client)
+
+async def _check_api_connection(client: PNCPAPIClient) -> bool:
+    """Authenticate and issue a small consultation request on the given client"""
+    success = await client.authenticate()
+    if success:
+        # Test a simple consultation API call
+        status, response = await client.get_tenders_by_publication_date(
+            start_date='20240101',
+            end_date='20240102',
+            modality_code=8,  # Dispensa
+            state='DF',
+            page=1
+        )
 
-            if status == 200:
-                logger.info(f"API test successful, found {response.get('totalRegistros', 0)} tenders")
-                return True
-            else:
-                logger.error(f"API test failed: {status} - {response}")
-                return False
+        if status == 200:
+            logger.info(f"API test successful, found {response.get('totalRegistros', 0)} tenders")
+            return True
         else:
-            logger.error("Authentication failed")
+            logger.error(f"API test failed: {status} - {response}")
             return False
+    else:
+        logger.error("Authentication failed")
+        return False
 
 async def discover_tenders_for_multiple_states(states: List[str], start_date: str, end_date: str,
                                              username: str = None, password: str = None) -> Dict[str, List[Dict]]:
@@ -431,20 +561,21 @@ async def discover_tenders_for_multiple_states(states: List[str], start_date: st
     async with PNCPAPIClient(username, password) as client:
         await client.authenticate()
 
-        tasks = []
-        for state in states:
-            task = client.discover_tenders_for_state(state, start_date, end_date)
-            tasks.append((state, task))
+        # All states share the client's keep-alive connection pool; the
+        # coroutines used to be awaited one after another despite the docstring
+        state_results = await asyncio.gather(
+            *(client.discover_tenders_for_state(state, start_date, end_date) for state in states),
+            return_exceptions=True
+        )
 
         results = {}
-        for state, task in tasks:
-            try:
-                tenders = await task
+        for state, tenders in zip(states, state_results):
+            if isinstance(tenders, Exception):
+                logger.error(f"Failed to discover tenders for {state}: {tenders}")
+                results[state] = []
+            else:
                 results[state] = tenders
                 logger.info(f"Completed tender discovery for {state}: {len(tenders)} tenders")
-            except Exception as e:
-                logger.error(f"Failed to discover tenders for {state}: {e}")
-                results[state] = []
 
         return results
 
@@ -3,31 +3,74 @@ Processed Tenders Tracker
 Keeps track of which tenders have been processed to avoid duplicates
 """
 
-import json
 import os
+import heapq
 import logging
-from typing import Set, List, Dict, Any
+import threading
+import orjson
+from functools import lru_cache
+from typing import Set, List, Dict, Any, Tuple
 from datetime import datetime, date
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
 
 logger = logging.getLogger(__name__)
 
-@dataclass
+@lru_cache(maxsize=4096)
+def normalize_cnpj(cnpj: str) -> str:
+    """Strip CNPJ punctuation (dots, slashes, dashes); cached since an organization's
+    CNPJ recurs across all of its tenders"""
+    return cnpj.replace(".", "").replace("/", "").replace("-", "")
+
+def tender_key(cnpj: str, ano: int, sequencial: int) -> str:
+    """Unique key of a tender, as used by TenderIdentifier and the tracker"""
+    return f"{normalize_cnpj(cnpj)}_{ano}_{sequencial}"
+
+def _record_value(record: 'ProcessedTenderRecord') -> float:
+    """Homologated value of a record as a float; database Decimals are saved as strings"""
+    try:
+        return float(record.homologated_value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+# The tracker keeps one identifier and one record per processed tender in memory,
+# so both are slotted. Slotted fields cannot have class-level defaults, so their
+# __init__ is written out to keep the optional arguments
+@dataclass(init=False)
 class TenderIdentifier:
     """Unique identifier for a tender"""
+    __slots__ = ('cnpj', 'ano', 'sequencial', 'state_code', 'unique_key')
+
     cnpj: str
     ano: int
     sequencial: int
-    state_code: str = ""
+    state_code: str
 
-    def __post_init__(self):
+    def __init__(self, cnpj: str, ano: int, sequencial: int, state_code: str = ""):
         # Normalize CNPJ (remove dots, slashes, dashes)
-        self.cnpj = self.cnpj.replace(".", "").replace("/", "").replace("-", "")
+        self.cnpj = normalize_cnpj(cnpj)
+        self.ano = ano
+        self.sequencial = sequencial
+        self.state_code = state_code
+        # Unique key for this tender, built once; hashing, equality and tracker
+        # lookups all go through it. Not a dataclass field, so it is not saved or repr()d
+        self.unique_key = tender_key(self.cnpj, ano, sequencial)
 
-    @property
-    def unique_key(self) -> str:
-        """Generate unique key for this tender"""
-        return f"{self.cnpj}_{self.ano}_{self.sequencial}"
+    @classmethod
+    def from_stored(cls, cnpj: str, ano: int, sequencial: int, state_code: str,
+                    unique_key: str) -> 'TenderIdentifier':
+        """Rebuild an identifier saved by the tracker
+
+        Its CNPJ is already normalized and its key is the one it was stored under,
+        so __init__ is skipped; loading a large file then neither re-normalizes
+        every CNPJ nor evicts live entries from the normalize_cnpj cache.
+        """
+        identifier = object.__new__(cls)
+        identifier.cnpj = cnpj
+        identifier.ano = ano
+        identifier.sequencial = sequencial
+        identifier.state_code = state_code
+        identifier.unique_key = unique_key
+        return identifier
 
     def __hash__(self):
         return hash(self.unique_key)
@@ -37,40 +80,73 @@ class TenderIdentifier:
             return self.unique_key == other.unique_key
         return False
 
-@dataclass
+@dataclass(init=False)
 class ProcessedTenderRecord:
     """Record of a processed tender with metadata"""
+    __slots__ = ('tender_id', 'processed_date', 'homologated_value', 'items_count',
+                 'matches_found', 'processing_status')
+
     tender_id: TenderIdentifier
     processed_date: str
     homologated_value: float
     items_count: int
     matches_found: int
-    processing_status: str = "completed"  # completed, failed, partial
+    processing_status: str  # completed, failed, partial
+
+    def __init__(self, tender_id: TenderIdentifier, processed_date: str, homologated_value: float,
+                 items_count: int, matches_found: int, processing_status: str = "completed"):
+        self.tender_id = tender_id
+        self.processed_date = processed_date
+        self.homologated_value = homologated_value
+        self.items_count = items_count
+        self.matches_found = matches_found
+        self.processing_status = processing_status
 
     @classmethod
-    def from_dict(cls, data: Dict[str, Any]) -> 'ProcessedTenderRecord':
-        """Create from dictionary (for JSON loading)"""
+    def from_dict(cls, data: Dict[str, Any], key: str = None) -> 'ProcessedTenderRecord':
+        """Create from dictionary (for JSON loading)
+
+        key is the unique key the record was stored under, if known; its identifier
+        is then rebuilt as stored rather than re-normalized.
+        """
         tender_id_data = data['tender_id']
-        tender_id = TenderIdentifier(
-            cnpj=tender_id_data['cnpj'],
-            ano=tender_id_data['ano'],
-            sequencial=tender_id_data['sequencial'],
-            state_code=tender_id_data.get('state_code', '')
-        )
+        # Positional arguments in field order; runs once per stored record at load
+        if key is not None:
+            tender_id = TenderIdentifier.from_stored(
+                tender_id_data['cnpj'],
+                tender_id_data['ano'],
+                tender_id_data['sequencial'],
+                tender_id_data.get('state_code', ''),
+                key
+            )
+        else:
+            tender_id = TenderIdentifier(
+                tender_id_data['cnpj'],
+                tender_id_data['ano'],
+                tender_id_data['sequencial'],
+                tender_id_data.get('state_code', '')
+            )
 
         return cls(
-            tender_id=tender_id,
-            processed_date=data['processed_date'],
-            homologated_value=data['homologated_value'],
-            items_count=data['items_count'],
-            matches_found=data['matches_found'],
-            processing_status=data.get('processing_status', 'completed')
+            tender_id,
+            data['processed_date'],
+            data['homologated_value'],
+            data['items_count'],
+            data['matches_found'],
+            data.get('processing_status', 'completed')
         )
 
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary for JSON storage"""
+        tender_id = self.tender_id
+        # Spelled out rather than asdict(), which walks fields and deep-copies values
         return {
-            'tender_id': asdict(self.tender_id),
+            'tender_id': {
+                'cnpj': tender_id.cnpj,
+                'ano': tender_id.ano,
+                'sequencial': tender_id.sequencial,
+                'state_code': tender_id.state_code
+            },
             'processed_date': self.processed_date,
             'homologated_value': self.homologated_value,
             'items_count': self.items_count,
@@ -83,15 +159,37 @@ class ProcessedTendersTracker:
 
     def __init__(self, storage_file: str = "processed_tenders.json"):
         self.storage_file = storage_file
+        # Records marked since the last full save are appended here as JSON lines,
+        # so a save writes only what changed; load replays it over the main file
+        self.journal_file = f"{storage_file}.journal"
         self.processed_tenders: Dict[str, ProcessedTenderRecord] = {}
+        # Keys marked since the last save, in marking order (a dict used as an ordered set)
+        self._unsaved_keys: Dict[str, None] = {}
+        self._journal_records = 0
+        # Set when records are removed, which the append-only journal cannot express,
+        # or when the journal has a damaged line that must not be appended to
+        self._rewrite_on_save = False
+        # Running statistics, updated as records are added and removed so
+        # get_processing_stats does not walk every record
+        self._by_status: Dict[str, int] = {}
+        self._by_state: Dict[str, int] = {}
+        self._total_value = 0.0
+        self._total_items = 0
+        self._total_matches = 0
+        # Min-heap of (processed_date, key) for dated records, so cleanup pops only
+        # expired records; entries whose record was re-marked or removed are skipped
+        self._expiry_heap: List[Tuple[str, str]] = []
         self.load_from_file()
 
     def load_from_file(self) -> bool:
-        """Load processed tenders from JSON file"""
+        """Load processed tenders from the JSON file and replay its journal"""
         try:
+            loaded = False
+
             if os.path.exists(self.storage_file):
-                with open(self.storage_file, 'r') as f:
-                    data = json.load(f)
+                # orjson reads both the compact files written below and older indented ones
+                with open(self.storage_file, 'rb') as f:
+                    data = orjson.loads(f.read())
 
                 # Convert from old format if needed
                 if isinstance(data, list):
@@ -119,25 +217,124 @@ class ProcessedTendersTracker:
                     # New format with full records
                     for key, record_data in data.items():
                         try:
-                            record = ProcessedTenderRecord.from_dict(record_data)
+                            record = ProcessedTenderRecord.from_dict(record_data, key)
                             self.processed_tenders[key] = record
                         except Exception as e:
                             logger.warning(f"Skipping invalid record {key}: {e}")
 
-                logger.info(f"Loaded {len(self.processed_tenders)} processed tenders from {self.storage_file}")
-                return True
-            else:
+                loaded = True
+
+            if os.path.exists(self.journal_file):
+                self._replay_journal()
+                loaded = True
+
+            if not loaded:
                 logger.info(f"No existing processed tenders file found. Starting fresh.")
                 return False
 
+            self._rebuild_indexes()
+            logger.info(f"Loaded {len(self.processed_tenders)} processed tenders from {self.storage_file}")
+            return True
+
         except Exception as e:
             logger.error(f"Failed to load processed tenders: {e}")
             logger.info("Starting with empty processed tenders list")
             self.processed_tenders = {}
             return False
 
+    def _replay_journal(self):
+        """Apply journaled records over the loaded ones; later lines win"""
+        processed = self.processed_tenders
+        from_dict = ProcessedTenderRecord.from_dict
+        count = 0
+
+        with open(self.journal_file, 'rb') as f:
+            for line in f:
+                count += 1
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError("line is not newline-terminated")
+                    key, record_data = orjson.loads(line)
+                    processed[key] = from_dict(record_data, key)
+                except Exception as e:
+                    # e.g. a line cut short by an interrupted save; appending after
+                    # it would glue the next record onto the broken line, so the
+                    # next save rewrites the whole file instead
+                    logger.warning(f"Skipping invalid journal line {count}: {e}")
+                    self._rewrite_on_save = True
+
+        self._journal_records = count
+
+    def _rebuild_indexes(self):
+        """Rebuild the expiry heap and running statistics from every record"""
+        self._expiry_heap = [
+            (record.processed_date, key) for key, record in self.processed_tenders.items()
+            if record.processed_date != "unknown" and record.processing_status != "legacy"
+        ]
+        heapq.heapify(self._expiry_heap)
+
+        self._reset_stats()
+        count_record = self._count_record
+        for record in self.processed_tenders.values():
+            count_record(record, 1)
+
+    def _reset_stats(self):
+        """Zero the running statistics"""
+        self._by_status = {}
+        self._by_state = {}
+        self._total_value = 0.0
+        self._total_items = 0
+        self._total_matches = 0
+
+    def _count_record(self, record: ProcessedTenderRecord, sign: int):
+        """Add (sign=1) or remove (sign=-1) a record from the running statistics"""
+        for counts, key in ((self._by_status, record.processing_status),
+                            (self._by_state, record.tender_id.state_code or "unknown")):
+            count = counts.get(key, 0) + sign
+            if count:
+                counts[key] = count
+            else:
+                counts.pop(key, None)
+
+        self._total_value += sign * _record_value(record)
+        self._total_items += sign * record.items_count
+        self._total_matches += sign * record.matches_found
+
     def save_to_file(self) -> bool:
-        """Save processed tenders to JSON file"""
+        """Save processed tenders, appending new records to the journal when possible
+
+        The whole file is rewritten (and the journal emptied) when there is no file
+        yet, after records were removed, or once the journal holds more records than
+        the tracker, so the journal never grows past the size of the data.
+        """
+        unsaved = self._unsaved_keys
+        if (self._rewrite_on_save or not os.path.exists(self.storage_file) or
+                self._journal_records + len(unsaved) > len(self.processed_tenders)):
+            return self._write_full_file()
+
+        if not unsaved:
+            return True
+
+        try:
+            processed = self.processed_tenders
+            # One JSON line per record; Decimal values become strings as in the full file
+            lines = [orjson.dumps([key, processed[key].to_dict()], default=str)
+                     for key in unsaved if key in processed]
+
+            with open(self.journal_file, 'ab') as f:
+                f.write(b'\n'.join(lines) + b'\n')
+
+            self._journal_records += len(lines)
+            unsaved.clear()
+            logger.info(f"Saved {len(lines)} new processed tenders to {self.journal_file}")
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to save processed tenders: {e}")
+            return False
+
+    def _write_full_file(self) -> bool:
+        """Rewrite the JSON file with every record and empty the journal"""
         try:
             # Convert to serializable format
             data = {}
@@ -147,11 +344,19 @@ class ProcessedTendersTracker:
             # Create backup of existing file
             if os.path.exists(self.storage_file):
                 backup_file = f"{self.storage_file}.backup"
-                os.rename(self.storage_file, backup_file)
+                os.replace(self.storage_file, backup_file)
 
-            # Save new data
-            with open(self.storage_file, 'w') as f:
-                json.dump(data, f, indent=2, default=str)
+            # Save new data as compact orjson output; values orjson cannot encode
+            # natively (e.g. Decimal homologated values from the database) become strings
+            with open(self.storage_file, 'wb') as f:
+                f.write(orjson.dumps(data, default=str))
+
+            # Every journaled record is in the file now
+            if os.path.exists(self.journal_file):
+                os.remove(self.journal_file)
+            self._journal_records = 0
+            self._unsaved_keys.clear()
+            self._rewrite_on_save = False
 
             logger.info(f"Saved {len(self.processed_tenders)} processed tenders to {self.storage_file}")
             return True
@@ -160,6 +365,14 @@ class ProcessedTendersTracker:
             logger.error(f"Failed to save processed tenders: {e}")
             return False
 
+    def clear(self):
+        """Forget every processed tender; the next save rewrites the file empty"""
+        self.processed_tenders.clear()
+        self._expiry_heap = []
+        self._reset_stats()
+        self._unsaved_keys.clear()
+        self._rewrite_on_save = True
+
     def is_processed(self, tender_id: TenderIdentifier) -> bool:
         """Check if tender has been processed"""
         return tender_id.unique_key in self.processed_tenders
@@ -179,24 +392,32 @@ class ProcessedTendersTracker:
             processing_status=status
         )
 
+        previous = self.processed_tenders.get(tender_id.unique_key)
+        if previous is not None:
+            self._count_record(previous, -1)
+        self._count_record(record, 1)
+
         self.processed_tenders[tender_id.unique_key] = record
+        self._unsaved_keys[tender_id.unique_key] = None
+        heapq.heappush(self._expiry_heap, (record.processed_date, tender_id.unique_key))
         logger.info(f"Marked tender as processed: {tender_id.unique_key}")
 
     def filter_unprocessed_tenders(self, tenders: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Filter out already processed tenders from a list"""
+        processed = self.processed_tenders
+        if not processed:
+            # Nothing can match (first run or after a reset); skip building keys
+            return list(tenders)
+
         unprocessed = []
         processed_count = 0
 
         for tender in tenders:
             try:
-                tender_id = TenderIdentifier(
-                    cnpj=tender.get('cnpj', ''),
-                    ano=tender.get('ano', 0),
-                    sequencial=tender.get('sequencial', 0),
-                    state_code=tender.get('state_code', '')
-                )
-
-                if not self.is_processed(tender_id):
+                # Build the lookup key directly instead of a TenderIdentifier per tender
+                key = tender_key(tender.get('cnpj', ''), tender.get('ano', 0), tender.get('sequencial', 0))
+
+                if key not in processed:
                     unprocessed.append(tender)
                 else:
                     processed_count += 1
@@ -223,36 +444,17 @@ class ProcessedTendersTracker:
                 "total_matches": 0
             }
 
-        stats = {
+        return {
             "total_processed": len(self.processed_tenders),
-            "by_status": {},
-            "total_value": 0.0,
-            "total_items": 0,
-            "total_matches": 0,
-            "by_state": {},
-            "processing_dates": []
+            "by_status": dict(self._by_status),
+            "total_value": self._total_value,
+            "total_items": self._total_items,
+            "total_matches": self._total_matches,
+            "by_state": dict(self._by_state),
+            "processing_dates": [record.processed_date for record in self.processed_tenders.values()
+                                 if record.processed_date != "unknown"]
         }
 
-        for record in self.processed_tenders.values():
-            # Status counts
-            status = record.processing_status
-            stats["by_status"][status] = stats["by_status"].get(status, 0) + 1
-
-            # Totals
-            stats["total_value"] += record.homologated_value
-            stats["total_items"] += record.items_count
-            stats["total_matches"] += record.matches_found
-
-            # By state
-            state = record.tender_id.state_code or "unknown"
-            stats["by_state"][state] = stats["by_state"].get(state, 0) + 1
-
-            # Dates
-            if record.processed_date != "unknown":
-                stats["processing_dates"].append(record.processed_date)
-
-        return stats
-
     def print_stats(self):
         """Print processing statistics"""
         stats = self.get_processing_stats()
@@ -272,8 +474,8 @@ class ProcessedTendersTracker:
             print(f"Total Matches: {stats['total_matches']:,}")
 
             print("\nBy State:")
-            sorted_states = sorted(stats['by_state'].items(), key=lambda x: x[1], reverse=True)
-            for state, count in sorted_states[:10]:  # Top 10 states
+            top_states = heapq.nlargest(10, stats['by_state'].items(), key=lambda x: x[1])
+            for state, count in top_states:  # Top 10 states
                 print(f"  {state}: {count:,}")
 
         print()
@@ -283,38 +485,52 @@ class ProcessedTendersTracker:
         from datetime import datetime, timedelta
 
         cutoff_date = datetime.now() - timedelta(days=days_to_keep)
+        # processed_date is written by datetime.isoformat(), whose strings order the
+        # same as the times they encode; records at or after the cutoff are kept
+        # by a string comparison, and only candidates for removal are parsed
+        cutoff_iso = cutoff_date.isoformat()
         original_count = len(self.processed_tenders)
 
-        # Keep records that are recent or have unknown dates (legacy)
-        filtered_records = {}
-        for key, record in self.processed_tenders.items():
-            if record.processed_date == "unknown" or record.processing_status == "legacy":
-                # Keep legacy records
-                filtered_records[key] = record
-            else:
-                try:
-                    processed_date = datetime.fromisoformat(record.processed_date.replace('Z', '+00:00'))
-                    if processed_date >= cutoff_date:
-                        filtered_records[key] = record
-                except:
-                    # Keep if we can't parse date
-                    filtered_records[key] = record
-
-        self.processed_tenders = filtered_records
+        # Only dated records are in the heap, so legacy and unknown-date records are
+        # kept without being visited; pop entries until the oldest is recent enough
+        heap = self._expiry_heap
+        processed = self.processed_tenders
+        while heap and heap[0][0] < cutoff_iso:
+            processed_date, key = heapq.heappop(heap)
+            record = processed.get(key)
+            if record is None or record.processed_date != processed_date:
+                # Record was removed or re-marked since this entry was pushed
+                continue
+            if record.processing_status == "legacy":
+                continue
+
+            try:
+                if datetime.fromisoformat(processed_date.replace('Z', '+00:00')) < cutoff_date:
+                    del processed[key]
+                    self._count_record(record, -1)
+            except:
+                # Keep if we can't parse date
+                pass
+
         removed_count = original_count - len(self.processed_tenders)
 
         if removed_count > 0:
             logger.info(f"Cleaned up {removed_count} old processed tender records")
+            self._rewrite_on_save = True
             self.save_to_file()
 
 # Global instance for easy access
 _tracker_instance = None
+_tracker_lock = threading.Lock()
 
 def get_processed_tenders_tracker() -> ProcessedTendersTracker:
     """Get global processed tenders tracker instance"""
     global _tracker_instance
     if _tracker_instance is None:
-        _tracker_instance = ProcessedTendersTracker()
+        # Checked again under the lock so concurrent first callers load the file once
+        with _tracker_lock:
+            if _tracker_instance is None:
+                _tracker_instance = ProcessedTendersTracker()
     return _tracker_instance
 
 def test_tracker():
@@ -5,7 +5,17 @@ Matches tender items with Fernandes product list using keywords, dimensions, and
 
 import re
 from fuzzywuzzy import fuzz
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, FrozenSet
+
+# Precompiled patterns for normalization and dimension extraction
+NON_WORD_PATTERN = re.compile(r'[^\w\s.,]')  # Keep dots and commas for dimensions
+WHITESPACE_PATTERN = re.compile(r'\s+')
+DIMENSION_PATTERN = re.compile(r'(\d+(?:[.,]\d+)?)\s*[xX×]\s*(\d+(?:[.,]\d+)?)')
+
+# Composite score weights
+KEYWORD_WEIGHT = 0.4
+DIMENSION_WEIGHT = 0.35
+FUZZY_WEIGHT = 0.25
 
 class ProductMatcher:
     def __init__(self):
@@ -25,21 +35,27 @@ class ProductMatcher:
         # Dimension tolerance (±20% range)
         self.dimension_tolerance = 0.2
 
+        # Per-description features (normalized text, keyword categories, dimensions),
+        # computed once so catalog products are not re-parsed for every tender item
+        self._features: Dict[str, Tuple[str, FrozenSet[str], List[Tuple[float, float]]]] = {}
+
     def normalize_text(self, text: str) -> str:
         """Normalize text for better matching"""
         if not text:
             return ""
         text = text.upper()
-        text = re.sub(r'[^\w\s.,]', ' ', text)  # Keep dots and commas for dimensions
-        text = re.sub(r'\s+', ' ', text)        # Multiple spaces to single
+        text = NON_WORD_PATTERN.sub(' ', text)   # Keep dots and commas for dimensions
+        text = WHITESPACE_PATTERN.sub(' ', text)  # Multiple spaces to single
         return text.strip()
 
     def extract_dimensions(self, text: str) -> List[Tuple[float, float]]:
         """Extract dimensions from text (e.g., '5x7', '10,5x12,5')"""
-        text = self.normalize_text(text)
+        return self._extract_normalized_dimensions(self.normalize_text(text))
+
+    def _extract_normalized_dimensions(self, text: str) -> List[Tuple[float, float]]:
+        """Extract dimensions from already-normalized text"""
         # Match patterns like "5x7", "10x12", "8,5x11,5", "5.5x7.2"
-        pattern = r'(\d+(?:[.,]\d+)?)\s*[xX×]\s*(\d+(?:[.,]\d+)?)'
-        matches = re.findall(pattern, text)
+        matches = DIMENSION_PATTERN.findall(text)
 
         dimensions = []
         for match in matches:
@@ -55,27 +71,31 @@ class ProductMatcher:
 
     def calculate_keyword_score(self, tender_text: str, product_description: str) -> float:
         """Calculate keyword matching score"""
-        tender_normalized = self.normalize_text(tender_text)
-        product_normalized = self.normalize_text(product_description)
+        tender_categories = self._keyword_categories(self.normalize_text(tender_text))
+        product_categories = self._keyword_categories(self.normalize_text(product_description))
+        return self._keyword_score(tender_categories, product_categories)
+
+    def _keyword_categories(self, normalized_text: str) -> FrozenSet[str]:
+        """Keyword categories with at least one keyword present in the text"""
+        return frozenset(
+            category for category, keywords in self.keywords.items()
+            if any(keyword in normalized_text for keyword in keywords)
+        )
 
+    def _keyword_score(self, tender_categories: FrozenSet[str], product_categories: FrozenSet[str]) -> float:
+        """Share of keyword categories present in both texts"""
         total_keywords = len(self.keywords)
-        matched_keywords = 0
-
-        for category, keywords in self.keywords.items():
-            # Check if any keyword from this category appears in both texts
-            tender_has_keyword = any(keyword in tender_normalized for keyword in keywords)
-            product_has_keyword = any(keyword in product_normalized for keyword in keywords)
-
-            if tender_has_keyword and product_has_keyword:
-                matched_keywords += 1
-
+        matched_keywords = len(tender_categories & product_categories)
         return (matched_keywords / total_keywords) * 100 if total_keywords > 0 else 0
 
     def calculate_dimension_score(self, tender_text: str, product_description: str) -> float:
         """Calculate dimension matching score with tolerance"""
-        tender_dims = self.extract_dimensions(tender_text)
-        product_dims = self.extract_dimensions(product_description)
+        return self._dimension_score(self.extract_dimensions(tender_text),
+                                     self.extract_dimensions(product_description))
 
+    def _dimension_score(self, tender_dims: List[Tuple[float, float]],
+                         product_dims: List[Tuple[float, float]]) -> float:
+        """Best dimension similarity between two sets of extracted dimensions"""
         if not tender_dims or not product_dims:
             return 0
 
@@ -119,13 +139,28 @@ class ProductMatcher:
 
         # Weighted composite score
         composite_score = (
-            keyword_score * 0.4 +      # 40% weight for keywords
-            dimension_score * 0.35 +   # 35% weight for dimensions
-            fuzzy_score * 0.25         # 25% weight for fuzzy matching
+            keyword_score * KEYWORD_WEIGHT +      # 40% weight for keywords
+            dimension_score * DIMENSION_WEIGHT +  # 35% weight for dimensions
+            fuzzy_score * FUZZY_WEIGHT            # 25% weight for fuzzy matching
         )
 
         return composite_score
 
+    def _get_features(self, text: str) -> Tuple[str, FrozenSet[str], List[Tuple[float, float]]]:
+        """Normalized text, keyword categories and dimensions for a description (cached)"""
+        features = self._features.get(text)
+        if features is None:
+            normalized = self.normalize_text(text)
+            features = (normalized, self._keyword_categories(normalized),
+                        self._extract_normalized_dimensions(normalized))
+            self._features[text] = features
+        return features
+
+    def prepare_catalog(self, product_list: List[Dict]) -> None:
+        """Parse every catalog description up front so matching starts with a warm cache"""
+        for product in product_list:
+            self._get_features(product.get('DESCRIÇÃO', ''))
+
     def find_best_match(self, tender_item: str, product_list: List[Dict],
                        min_score: float = 50.0) -> Optional[Tuple[Dict, float]]:
         """Find the best matching product for a tender item"""
@@ -135,8 +170,37 @@ class ProductMatcher:
         best_match = None
         best_score = 0
 
+        # Parse the tender item once instead of once per product
+        tender_normalized = self.normalize_text(tender_item)
+        tender_categories = self._keyword_categories(tender_normalized)
+        tender_dims = self._extract_normalized_dimensions(tender_normalized)
+        keyword_score = self._keyword_score
+
+        # Upper bound for any product: keywords can only match categories the tender
+        # item has, and dimensions only score if it has dimensions at all. Items that
+        # cannot reach min_score (e.g. no dimensions, no keywords) skip the catalog scan.
+        max_score = (keyword_score(tender_categories, tender_categories) * KEYWORD_WEIGHT +
+                     (100 * DIMENSION_WEIGHT if tender_dims else 0) +
+                     100 * FUZZY_WEIGHT)
+        if max_score < min_score:
+            return None
+
+        get_features = self._get_features
+        dimension_score = self._dimension_score
+        partial_ratio = fuzz.partial_ratio
+
         for product in product_list:
-            score = self.calculate_composite_score(tender_item, product)
+            product_normalized, product_categories, product_dims = get_features(product.get('DESCRIÇÃO', ''))
+
+            partial_score = (keyword_score(tender_categories, product_categories) * KEYWORD_WEIGHT +
+                             dimension_score(tender_dims, product_dims) * DIMENSION_WEIGHT)
+
+            # Fuzzy scoring is the expensive part; skip it when even a perfect
+            # fuzzy score could not beat the current best or reach min_score
+            if partial_score + 100 * FUZZY_WEIGHT < max(min_score, best_score):
+                continue
+
+            score = partial_score + partial_ratio(tender_normalized, product_normalized) * FUZZY_WEIGHT
 
             if score > best_score and score >= min_score:
                 best_score = score
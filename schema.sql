@@ -32,6 +32,7 @@ CREATE TABLE IF NOT EXISTS tenders (
     municipality_code VARCHAR(10),
     status VARCHAR(50),
     process_category INTEGER,
+    items_fetched_at TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE(cnpj, ano, sequencial)
@@ -116,6 +117,18 @@ CREATE INDEX IF NOT EXISTS idx_tenders_state ON tenders(state_code);
 CREATE INDEX IF NOT EXISTS idx_tenders_gov_level ON tenders(government_level);
 CREATE INDEX IF NOT EXISTS idx_tenders_publication_date ON tenders(publication_date);
 CREATE INDEX IF NOT EXISTS idx_tenders_homologated_value ON tenders(total_homologated_value);
+CREATE INDEX IF NOT EXISTS idx_tenders_homologated_value_id ON tenders(total_homologated_value DESC, id DESC);
+
+-- Checkpoint for item extraction (added after initial release; CREATE TABLE
+-- above is a no-op on existing databases)
+ALTER TABLE tenders ADD COLUMN IF NOT EXISTS items_fetched_at TIMESTAMP;
+CREATE INDEX IF NOT EXISTS idx_tenders_items_pending ON tenders(total_homologated_value DESC, id DESC)
+    WHERE items_fetched_at IS NULL;
+-- Stamp tenders whose items were stored, or found empty, before the checkpoint
+-- existed; pending tenders are then selected by items_fetched_at alone
+UPDATE tenders t SET items_fetched_at = CURRENT_TIMESTAMP
+WHERE t.items_fetched_at IS NULL
+  AND (t.status = 'no_items' OR EXISTS (SELECT 1 FROM tender_items ti WHERE ti.tender_id = t.id));
 
 CREATE INDEX IF NOT EXISTS idx_tender_items_tender_id ON tender_items(tender_id);
 CREATE INDEX IF NOT EXISTS idx_tender_items_item_number ON tender_items(item_number);
@@ -123,6 +136,10 @@ CREATE INDEX IF NOT EXISTS idx_tender_items_item_number ON tender_items(item_num
 CREATE INDEX IF NOT EXISTS idx_matched_products_tender_item_id ON matched_products(tender_item_id);
 CREATE INDEX IF NOT EXISTS idx_matched_products_fernandes_code ON matched_products(fernandes_product_code);
 CREATE INDEX IF NOT EXISTS idx_matched_products_match_score ON matched_products(match_score);
+-- Recent competitive matches for the Notion opportunities export
+CREATE INDEX IF NOT EXISTS idx_matched_products_competitive_recent
+    ON matched_products(created_at, price_difference_percent DESC)
+    WHERE is_competitive;
 
 CREATE INDEX IF NOT EXISTS idx_processing_log_process_type ON processing_log(process_type);
 CREATE INDEX IF NOT EXISTS idx_processing_log_state ON processing_log(state_code);
@@ -42,6 +42,7 @@ class NotionDatabaseCreator:
                 "Title": {"title": {}},
                 "Organization": {"rich_text": {}},
                 "CNPJ": {"rich_text": {}},
+                "Control Number": {"rich_text": {}},
                 "State": {
                     "select": {
                         "options": [
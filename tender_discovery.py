@@ -5,8 +5,13 @@ Discovers and filters tenders across Brazilian states with medical relevance cla
 
 import asyncio
 import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple, Set
+from functools import partial
+from typing import Dict, List, Optional, Tuple, Set, AsyncIterator
 from dataclasses import dataclass, asdict
 import json
 
@@ -15,11 +20,18 @@ from config import (
     TenderSize, get_state_codes, classify_tender_size
 )
 from pncp_api import PNCPAPIClient
-from classifier import TenderClassifier, ClassificationResult
+from classifier import (
+    TenderClassifier, ClassificationResult, attach_classifications, select_relevant_tenders_in_worker
+)
 from database import DatabaseOperations, CloudSQLManager
 
 logger = logging.getLogger(__name__)
 
+# Control numbers and organizations an engine remembers between lookups; each
+# cache is cleared when full so a long-lived engine's memory stays bounded
+KNOWN_CONTROL_NUMBERS_CACHE_SIZE = 200_000
+STORED_ORGANIZATIONS_CACHE_SIZE = 50_000
+
 @dataclass
 class DiscoveryStats:
     """Statistics for tender discovery process"""
@@ -44,6 +56,20 @@ class DiscoveryStats:
         if self.errors is None:
             self.errors = []
 
+    def merge(self, other: 'DiscoveryStats'):
+        """Fold another stats object into this one"""
+        self.total_found += other.total_found
+        self.medical_relevant += other.medical_relevant
+        self.processing_time_seconds += other.processing_time_seconds
+        self.errors.extend(other.errors)
+
+        for totals, counts in ((self.by_state, other.by_state),
+                               (self.by_government_level, other.by_government_level),
+                               (self.by_size, other.by_size),
+                               (self.by_modality, other.by_modality)):
+            for key, value in counts.items():
+                totals[key] = totals.get(key, 0) + value
+
 class TenderDiscoveryEngine:
     """Discovers and classifies tenders for medical supplies across Brazilian states"""
 
@@ -54,11 +80,36 @@ class TenderDiscoveryEngine:
         self.db_ops = db_operations
         self.config = config or ProcessingConfig()
 
+        # Control numbers known to be in the tenders table (stored by this engine or
+        # reported as existing); chunk boundaries overlap by a day, and repeat runs
+        # on one engine see the same tenders, so these skip the database lookup
+        # (used only with config.skip_known_tenders)
+        self._known_control_numbers: Set[str] = set()
+
+        # Organizations written by this engine: CNPJ -> (stored fields, row id).
+        # Filled as each organization is upserted, so later tenders from the same
+        # organization reuse the id instead of repeating the SELECT + UPDATE
+        self._stored_organizations: Dict[str, Tuple[Tuple, int]] = {}
+
+        # Worker processes for classifying large batches, started on first use
+        self._classify_pool: Optional[ProcessPoolExecutor] = None
+        self._classify_workers = os.cpu_count() or 1
+
+    async def close(self):
+        """Shut down the classification worker processes, if any were started
+
+        Waits for the workers to exit, off the event loop, so none outlive the engine.
+        """
+        pool, self._classify_pool = self._classify_pool, None
+        if pool is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                None, partial(pool.shutdown, wait=True, cancel_futures=True))
+
     async def discover_tenders_for_date_range(self, start_date: str, end_date: str,
                                             states: List[str] = None) -> DiscoveryStats:
         """Discover tenders across states for a specific date range"""
 
-        start_time = datetime.now()
+        start_time = time.perf_counter()
         stats = DiscoveryStats()
 
         if states is None:
@@ -67,7 +118,7 @@ class TenderDiscoveryEngine:
         logger.info(f"Starting tender discovery for {len(states)} states from {start_date} to {end_date}")
 
         # Start processing log
-        log_id = await self.db_ops.log_processing_start(
+        run = await self.db_ops.log_processing_start(
             'tender_discovery',
             metadata={
                 'start_date': start_date,
@@ -78,17 +129,29 @@ class TenderDiscoveryEngine:
         )
 
         try:
-            # Process each state
-            for state_code in states:
+            # States are independent API scrapes, so run several at once; the
+            # shared API client's rate limiter paces the combined request rate.
+            # Only the API fetch holds a slot, so the next state's fetch starts
+            # while earlier states are still classifying and persisting.
+            fetch_semaphore = asyncio.Semaphore(self.config.max_concurrent_states)
+
+            state_results = await asyncio.gather(
+                *(self._discover_state_tenders(state_code, start_date, end_date, fetch_semaphore)
+                  for state_code in states),
+                return_exceptions=True
+            )
+
+            for state_code, state_stats in zip(states, state_results):
                 try:
-                    state_stats = await self._discover_state_tenders(
-                        state_code, start_date, end_date
-                    )
+                    if isinstance(state_stats, Exception):
+                        raise state_stats
 
                     # Update overall stats
                     stats.total_found += state_stats.total_found
                     stats.medical_relevant += state_stats.medical_relevant
                     stats.by_state[state_code] = state_stats.total_found
+                    run.records_processed += state_stats.total_found
+                    run.records_matched += state_stats.medical_relevant
 
                     # Merge other statistics
                     self._merge_stats_dicts(stats.by_government_level, state_stats.by_government_level)
@@ -104,12 +167,10 @@ class TenderDiscoveryEngine:
                     stats.errors.append(error_msg)
 
             # Calculate processing time
-            stats.processing_time_seconds = (datetime.now() - start_time).total_seconds()
+            stats.processing_time_seconds = time.perf_counter() - start_time
 
             # Log completion
-            await self.db_ops.log_processing_end(
-                log_id, 'completed', stats.total_found, stats.medical_relevant
-            )
+            await self.db_ops.log_processing_end(run, 'completed')
 
             logger.info(f"Discovery completed: {stats.total_found} total tenders, "
                        f"{stats.medical_relevant} medical relevant in {stats.processing_time_seconds:.1f}s")
@@ -118,96 +179,206 @@ class TenderDiscoveryEngine:
             error_msg = f"Discovery process failed: {str(e)}"
             logger.error(error_msg)
             stats.errors.append(error_msg)
-            await self.db_ops.log_processing_end(log_id, 'failed', error_message=error_msg)
+            await self.db_ops.log_processing_end(run, 'failed', error_message=error_msg)
 
         return stats
 
-    async def _discover_state_tenders(self, state_code: str, start_date: str, end_date: str) -> DiscoveryStats:
-        """Discover tenders for a specific state"""
+    async def _discover_state_tenders(self, state_code: str, start_date: str, end_date: str,
+                                      fetch_semaphore: Optional[asyncio.Semaphore] = None) -> DiscoveryStats:
+        """Discover tenders for a specific state
+
+        Each modality's tenders are filtered, classified and stored as soon as the API
+        has paged through them, while the remaining modalities are still being fetched.
+        When fetch_semaphore is given, it bounds only the API fetch.
+        """
 
         state_stats = DiscoveryStats()
         state_name = BRAZILIAN_STATES.get(state_code, state_code)
 
         logger.info(f"Discovering tenders for {state_name} ({state_code})")
 
-        try:
-            # Discover raw tenders
-            raw_tenders = await self.api_client.discover_tenders_for_state(
-                state_code, start_date, end_date, self.config.allowed_modalities
-            )
-
-            state_stats.total_found = len(raw_tenders)
-
-            if not raw_tenders:
-                logger.info(f"No tenders found for {state_code}")
-                return state_stats
-
-            # Process and classify tenders
-            processed_tenders = await self._process_raw_tenders(raw_tenders, state_code)
+        # Fetched batches wait here for processing; there is at most one per modality
+        batches: asyncio.Queue = asyncio.Queue()
 
-            # Filter relevant tenders
-            relevant_tenders = self.classifier.filter_relevant_tenders(
-                processed_tenders,
-                min_medical_score=self.config.min_match_score,
-                allowed_gov_levels=self.config.government_levels,
-                min_value=self.config.min_tender_value
-            )
+        async def put_batches():
+            async for batch in self.api_client.iter_tenders_for_state(
+                state_code, start_date, end_date, self.config.allowed_modalities
+            ):
+                batches.put_nowait(batch)
 
-            state_stats.medical_relevant = len(relevant_tenders)
+        async def fetch_batches():
+            try:
+                if fetch_semaphore is not None:
+                    async with fetch_semaphore:
+                        await put_batches()
+                else:
+                    await put_batches()
+            finally:
+                batches.put_nowait(None)
 
-            # Store relevant tenders in database
-            await self._store_tenders(relevant_tenders, state_code)
+        fetcher = asyncio.create_task(fetch_batches())
 
-            # Update statistics
-            self._update_state_stats(state_stats, relevant_tenders)
+        try:
+            while True:
+                raw_tenders = await batches.get()
+                if raw_tenders is None:
+                    break
+                if raw_tenders:
+                    await self._discover_tender_batch(raw_tenders, state_code, state_stats)
+                # Processed records copy the fields they need; release the raw API
+                # payloads now rather than holding them until the state is finished
+                del raw_tenders
+
+            # Surface fetch errors once every fetched batch has been handled
+            await fetcher
+
+            if not state_stats.total_found:
+                logger.info(f"No tenders found for {state_code}")
 
         except Exception as e:
             error_msg = f"Error discovering tenders for {state_code}: {str(e)}"
             logger.error(error_msg)
             state_stats.errors.append(error_msg)
 
+        finally:
+            fetcher.cancel()
+
         return state_stats
 
+    async def _discover_tender_batch(self, raw_tenders: List[Dict], state_code: str,
+                                     state_stats: DiscoveryStats):
+        """Filter, classify and store one batch of raw tenders, counting it into state_stats"""
+
+        state_stats.total_found += len(raw_tenders)
+
+        # Process and classify tenders
+        processed_tenders = await self._process_raw_tenders(raw_tenders, state_code)
+
+        if self.config.skip_known_tenders:
+            processed_tenders = await self._drop_known_tenders(processed_tenders)
+
+        # Filter relevant tenders
+        relevant_tenders = await self._filter_relevant_tenders(processed_tenders)
+
+        state_stats.medical_relevant += len(relevant_tenders)
+
+        # Store relevant tenders in database, tallying statistics in the same pass
+        await self._store_tenders(relevant_tenders, state_code, state_stats)
+
+    async def _drop_known_tenders(self, tenders: List[Dict]) -> List[Dict]:
+        """Drop tenders already stored by a previous discovery run
+
+        Only control numbers not already known to be stored go to the database.
+        Used when config.skip_known_tenders is set; the dropped tenders are not
+        upserted again and do not count towards the discovery statistics.
+        """
+        known = self._known_control_numbers
+        candidates = {t['control_number'] for t in tenders
+                      if t.get('control_number') and t['control_number'] not in known}
+        new_control_numbers = await self.db_ops.filter_new_tenders(list(candidates))
+        self._remember_control_numbers(candidates - new_control_numbers)
+        return [
+            t for t in tenders
+            if not t.get('control_number') or t['control_number'] in new_control_numbers
+        ]
+
+    async def _filter_relevant_tenders(self, tenders: List[Dict]) -> List[Dict]:
+        """Classify tenders and keep the relevant ones
+
+        Small batches are classified inline. Batches of at least
+        config.min_tenders_for_process_pool are split across worker processes, so
+        classification runs in parallel and the event loop keeps serving API and
+        database I/O meanwhile. Workers use a default TenderClassifier.
+        """
+        criteria = (self.config.min_match_score, self.config.government_levels,
+                    self.config.min_tender_value)
+
+        threshold = self.config.min_tenders_for_process_pool
+        if not threshold or len(tenders) < threshold:
+            return self.classifier.filter_relevant_tenders(tenders, *criteria)
+
+        if self._classify_pool is None:
+            # spawn rather than fork: the parent runs an event loop and open connections
+            self._classify_pool = ProcessPoolExecutor(
+                max_workers=self._classify_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+
+        loop = asyncio.get_running_loop()
+        chunk_size = -(-len(tenders) // self._classify_workers)
+        offsets = range(0, len(tenders), chunk_size)
+        chunk_results = await asyncio.gather(*(
+            loop.run_in_executor(self._classify_pool, select_relevant_tenders_in_worker,
+                                 tenders[offset:offset + chunk_size], *criteria)
+            for offset in offsets
+        ))
+
+        # Workers report positions within their chunk
+        selected = [(offset + index, classification)
+                    for offset, chunk_selected in zip(offsets, chunk_results)
+                    for index, classification in chunk_selected]
+        return attach_classifications(tenders, selected)
+
     async def _process_raw_tenders(self, raw_tenders: List[Dict], state_code: str) -> List[Dict]:
         """Process raw tender data and add metadata"""
 
         processed_tenders = []
 
+        safe_float = self._safe_float
+        parse_date = self._parse_date
+
         for tender in raw_tenders:
             try:
+                get = tender.get
+
+                # Only process tenders with homologated value (completed tenders);
+                # checked first so other tenders skip building the record
+                homologated_value = safe_float(get('valorTotalHomologado'))
+                if not (homologated_value and homologated_value > 0):
+                    continue
+
+                # Organization fields are read from one lookup; the API may send null
+                org = get('orgaoEntidade') or {}
+
                 # Extract key fields
                 processed_tender = {
-                    'cnpj': tender.get('cnpj', ''),
-                    'ano': tender.get('ano') or tender.get('anoCompra'),
-                    'sequencial': tender.get('sequencial') or tender.get('sequencialCompra'),
-                    'control_number': tender.get('numeroControlePNCPCompra'),
-                    'title': tender.get('objetoCompra', ''),
-                    'description': tender.get('descricao', ''),
-                    'organization_name': tender.get('orgaoEntidade', {}).get('razaoSocial', ''),
-                    'total_estimated_value': self._safe_float(tender.get('valorTotalEstimado')),
-                    'total_homologated_value': self._safe_float(tender.get('valorTotalHomologado')),
-                    'publication_date': self._parse_date(tender.get('dataPublicacaoPncp')),
-                    'contracting_modality': tender.get('modalidadeId'),
-                    'modality_name': tender.get('modalidadeNome', ''),
+                    'cnpj': get('cnpj') or org.get('cnpj', ''),
+                    'ano': get('ano') or get('anoCompra'),
+                    'sequencial': get('sequencial') or get('sequencialCompra'),
+                    'control_number': get('numeroControlePNCPCompra'),
+                    'title': get('objetoCompra', ''),
+                    'description': get('descricao', ''),
+                    'organization_name': org.get('razaoSocial', ''),
+                    'total_estimated_value': safe_float(get('valorTotalEstimado')),
+                    'total_homologated_value': homologated_value,
+                    'publication_date': parse_date(get('dataPublicacaoPncp')),
+                    'contracting_modality': get('modalidadeId'),
+                    'modality_name': get('modalidadeNome', ''),
                     'state_code': state_code,
-                    'municipality_code': tender.get('codigoIbgeMunicipio'),
-                    'raw_data': tender  # Keep original for reference
+                    'municipality_code': get('codigoIbgeMunicipio')
                 }
 
-                # Only process tenders with homologated value (completed tenders)
-                if processed_tender['total_homologated_value'] and processed_tender['total_homologated_value'] > 0:
-                    processed_tenders.append(processed_tender)
+                processed_tenders.append(processed_tender)
 
             except Exception as e:
-                logger.warning(f"Error processing tender {tender.get('numeroControlePNCPCompra', 'unknown')}: {e}")
+                logger.warning("Error processing tender %s: %s", tender.get('numeroControlePNCPCompra', 'unknown'), e)
 
         logger.info(f"Processed {len(processed_tenders)} completed tenders from {len(raw_tenders)} raw tenders")
         return processed_tenders
 
-    async def _store_tenders(self, tenders: List[Dict], state_code: str):
-        """Store tenders and organizations in database"""
+    async def _store_tenders(self, tenders: List[Dict], state_code: str,
+                             stats: Optional[DiscoveryStats] = None):
+        """Store tenders and organizations in database
+
+        When stats is given, each tender is counted into it as it is visited, so
+        callers do not need a second pass over the list.
+        """
+        skip_known = self.config.skip_known_tenders
 
         for tender in tenders:
+            if stats is not None:
+                self._update_tender_stats(stats, tender)
+
             try:
                 classification = tender.get('classification')
                 if not classification:
@@ -222,7 +393,15 @@ class TenderDiscoveryEngine:
                     'state_code': state_code
                 }
 
-                org_id = await self.db_ops.insert_organization(org_data)
+                org_fields = tuple(org_data.values())
+                stored = self._stored_organizations.get(org_data['cnpj'])
+                if stored is not None and stored[0] == org_fields:
+                    org_id = stored[1]
+                else:
+                    org_id = await self.db_ops.insert_organization(org_data)
+                    if len(self._stored_organizations) >= STORED_ORGANIZATIONS_CACHE_SIZE:
+                        self._stored_organizations.clear()
+                    self._stored_organizations[org_data['cnpj']] = (org_fields, org_id)
 
                 # Store tender
                 tender_data = {
@@ -247,27 +426,36 @@ class TenderDiscoveryEngine:
 
                 await self.db_ops.insert_tender(tender_data)
 
+                if skip_known and tender_data['control_number']:
+                    self._remember_control_numbers((tender_data['control_number'],))
+
             except Exception as e:
-                logger.error(f"Error storing tender {tender.get('control_number', 'unknown')}: {e}")
+                logger.error("Error storing tender %s: %s", tender.get('control_number', 'unknown'), e)
 
-    def _update_state_stats(self, stats: DiscoveryStats, tenders: List[Dict]):
-        """Update statistics with tender data"""
+    def _remember_control_numbers(self, control_numbers):
+        """Record control numbers known to be stored, clearing the cache when full"""
+        known = self._known_control_numbers
+        if len(known) >= KNOWN_CONTROL_NUMBERS_CACHE_SIZE:
+            known.clear()
+        known.update(control_numbers)
 
-        for tender in tenders:
-            classification = tender.get('classification')
-            if classification:
-                # Government level
-                gov_level = classification.government_level.value
-                stats.by_government_level[gov_level] = stats.by_government_level.get(gov_level, 0) + 1
+    def _update_tender_stats(self, stats: DiscoveryStats, tender: Dict):
+        """Count one tender into the statistics"""
+
+        classification = tender.get('classification')
+        if classification:
+            # Government level
+            gov_level = classification.government_level.value
+            stats.by_government_level[gov_level] = stats.by_government_level.get(gov_level, 0) + 1
 
-                # Tender size
-                size = classification.tender_size.value
-                stats.by_size[size] = stats.by_size.get(size, 0) + 1
+            # Tender size
+            size = classification.tender_size.value
+            stats.by_size[size] = stats.by_size.get(size, 0) + 1
 
-            # Modality
-            modality = tender.get('contracting_modality')
-            if modality:
-                stats.by_modality[str(modality)] = stats.by_modality.get(str(modality), 0) + 1
+        # Modality
+        modality = tender.get('contracting_modality')
+        if modality:
+            stats.by_modality[str(modality)] = stats.by_modality.get(str(modality), 0) + 1
 
     def _merge_stats_dicts(self, target: Dict[str, int], source: Dict[str, int]):
         """Merge statistics dictionaries"""
@@ -323,11 +511,16 @@ class TenderDiscoveryEngine:
     async def discover_by_date_chunks(self, start_date: str, end_date: str,
                                     chunk_days: int = 7, states: List[str] = None) -> List[DiscoveryStats]:
         """Discover tenders by breaking date range into chunks to avoid API limits"""
+        return [chunk_stats async for chunk_stats in
+                self.iter_discover_by_date_chunks(start_date, end_date, chunk_days, states)]
+
+    async def iter_discover_by_date_chunks(self, start_date: str, end_date: str, chunk_days: int = 7,
+                                           states: List[str] = None) -> AsyncIterator[DiscoveryStats]:
+        """Yield discovery stats chunk by chunk so callers can fold them without holding the list"""
 
         start_dt = datetime.strptime(start_date, '%Y%m%d')
         end_dt = datetime.strptime(end_date, '%Y%m%d')
 
-        chunk_results = []
         current_date = start_dt
 
         while current_date < end_dt:
@@ -342,18 +535,16 @@ class TenderDiscoveryEngine:
                 chunk_stats = await self.discover_tenders_for_date_range(
                     chunk_start_str, chunk_end_str, states
                 )
-                chunk_results.append(chunk_stats)
+            except Exception as e:
+                logger.error(f"Error processing chunk {chunk_start_str}-{chunk_end_str}: {e}")
+            else:
+                yield chunk_stats
 
                 # Small delay between chunks
                 await asyncio.sleep(1)
 
-            except Exception as e:
-                logger.error(f"Error processing chunk {chunk_start_str}-{chunk_end_str}: {e}")
-
             current_date = chunk_end
 
-        return chunk_results
-
 
 # Utility functions for discovery management
 async def create_discovery_engine(db_manager: CloudSQLManager, username: str = None,
@@ -377,7 +568,10 @@ async def run_full_state_discovery(states: List[str], start_date: str, end_date:
 
         engine = TenderDiscoveryEngine(api_client, classifier, db_ops)
 
-        return await engine.discover_tenders_for_date_range(start_date, end_date, states)
+        try:
+            return await engine.discover_tenders_for_date_range(start_date, end_date, states)
+        finally:
+            await engine.close()
 
 def print_discovery_stats(stats: DiscoveryStats):
     """Print formatted discovery statistics"""
@@ -5,6 +5,7 @@ Shows what tenders have been processed and statistics
 """
 
 import argparse
+import heapq
 from processed_tenders_tracker import get_processed_tenders_tracker
 from datetime import datetime
 
@@ -23,7 +24,7 @@ def main():
     if args.reset:
         confirm = input("⚠️  Are you sure you want to reset ALL processed records? (type 'yes'): ")
         if confirm.lower() == 'yes':
-            tracker.processed_tenders.clear()
+            tracker.clear()
             tracker.save_to_file()
             print("✅ All processed records have been reset")
             return
@@ -42,8 +43,8 @@ def main():
     # Show recent processing activity
     stats = tracker.get_processing_stats()
     if stats['processing_dates']:
-        # Sort dates and show recent activity
-        recent_dates = sorted(stats['processing_dates'])[-10:]
+        # Show the 10 most recent dates, oldest first, without sorting them all
+        recent_dates = heapq.nlargest(10, stats['processing_dates'])[::-1]
         if recent_dates:
             print("🕒 Recent Processing Activity:")
             for date_str in recent_dates: